@@ -6,15 +6,28 @@ retries on errors up to MAX_RETRIES, and returns the processed result.
 import os
 import re
 import ast
-import openai
 from dotenv import load_dotenv
 from app.tools import run_python
+from app.llm import chat, PRIORITY_CODE, PRIORITY_REFLECTION
 from app.memory import get_cache, set_cache
+from app.results import INLINE_ROWS, load_table, result_path, save_table, summarize
 
 load_dotenv()
 
 MAX_RETRIES = 8
 CODE_MODEL = os.getenv("OPENAI_CODE_MODEL", "gpt-4.1-mini")
+# Prefixes of the messages `main` returns when it could not answer the question
+FAILURE_PREFIXES = ("OpenAI API error:", "Failed to generate working code")
+# Failures that may succeed on another attempt; an exhausted retry loop would only repeat itself
+TRANSIENT_FAILURE_PREFIXES = ("OpenAI API error:",)
+
+def is_failure(result) -> bool:
+    """True if `result` is one of the failure messages returned by `main`."""
+    return isinstance(result, str) and result.startswith(FAILURE_PREFIXES)
+
+def is_transient_failure(result) -> bool:
+    """True if `result` is a failure message worth retrying (e.g. an LLM API error)."""
+    return isinstance(result, str) and result.startswith(TRANSIENT_FAILURE_PREFIXES)
 
 def extract_code(text: str) -> str:
     """
@@ -40,6 +53,42 @@ def post_process(raw: str):
     except Exception:
         return raw
 
+def format_result(processed, result_id: str = None):
+    """
+    Format DataFrame-like outputs as Markdown tables; other values are returned unchanged.
+    DataFrames that exceed INLINE_ROWS become a paginated table handle; `result_id` names
+    the stored table when `processed` is only its first rows.
+    """
+    final = processed
+    try:
+        import pandas as _pd
+        if isinstance(processed, _pd.DataFrame):
+            if len(processed) > INLINE_ROWS:
+                # Large tables are served in pages via /results/{result_id}
+                final = {'table': summarize(result_id or save_table(processed))}
+            else:
+                try:
+                    final = processed.to_markdown(index=False)
+                except ImportError:
+                    final = processed.to_string(index=False)
+        elif isinstance(processed, list) and processed and isinstance(processed[0], dict):
+            final = _pd.DataFrame(processed).to_markdown(index=False)
+        elif isinstance(processed, dict):
+            final = _pd.DataFrame(processed).to_markdown(index=False)
+    except Exception:
+        pass
+    return final
+
+def _expired_table(cached) -> bool:
+    """True if a cached answer is a table handle whose stored result has been deleted."""
+    if not (isinstance(cached, dict) and isinstance(cached.get('table'), dict)):
+        return False
+    try:
+        result_path(cached['table'].get('result_id'))
+    except ValueError:
+        return True
+    return False
+
 def main(question: str, csv_path: str):
     """
     Main entry: generate and execute pandas code to answer `question` on CSV at `csv_path`.
@@ -48,6 +97,12 @@ def main(question: str, csv_path: str):
     print(f"[Agent] Question: {question}")
     if not os.path.exists(csv_path):
         raise ValueError(f"CSV file not found: {csv_path}")
+    # Common filter/groupby/aggregate questions compile straight to pandas, no LLM needed
+    try:
+        from app.compiler import answer_question as compile_answer
+        return format_result(compile_answer(question, csv_path))
+    except ValueError:
+        pass
     # Quick fallback to deterministic oracle for simple questions
     try:
         from app.oracle import answer_question
@@ -57,12 +112,15 @@ def main(question: str, csv_path: str):
     cache_key = f"{question}@@{csv_path}"
     print(f"[Agent] Cache key: {cache_key}")
     cached = get_cache(cache_key)
-    if cached is not None:
+    if cached is not None and not _expired_table(cached):
         return cached
     system_prompt = (
         "You are an expert Python developer. Generate Python code using only pandas to answer the "
-        "following question on a CSV file. The CSV file path is provided in the variable `csv_path`. "
-        "Do not import any libraries other than pandas. Respond with only the code, without additional explanation.\n"
+        "following question on a CSV file. Start with `import pandas as pd`. The CSV is already loaded into a "
+        "pandas DataFrame `df`; use it instead of reading the file again. The file path is in `csv_path`. "
+        "Do not import any libraries other than pandas. If the answer is a table (DataFrame or Series), pass it to "
+        "`emit_result(obj)` instead of printing it; otherwise print the answer. "
+        "Respond with only the code, without additional explanation.\n"
     )
     prev_code = None
     error = ""
@@ -81,7 +139,7 @@ def main(question: str, csv_path: str):
         print("[Agent] Generating code via OpenAI...")
         try:
             # Generate code via ChatCompletion
-            response = openai.ChatCompletion.create(
+            response = chat(
                 model=CODE_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -90,6 +148,7 @@ def main(question: str, csv_path: str):
                 max_tokens=512,
                 temperature=0,
                 timeout=5,
+                priority=PRIORITY_CODE,
             )
             text = response.choices[0].message.content
         except Exception as e:
@@ -103,14 +162,16 @@ def main(question: str, csv_path: str):
             continue
         prev_code = code
         # Visualization enhancement: detect plotting code and generate chart via local tool
-        try:
-            plot_keywords = ['plt.', '.plot(', 'hist(', 'bar(', 'scatter(']
-            if any(kw in code for kw in plot_keywords):
-                from app.tools import plot_chart
-                files = plot_chart(code, csv_path)
-                return {'files': files}
-        except Exception:
-            pass
+        plot_keywords = ['plt.', '.plot(', 'hist(', 'bar(', 'scatter(']
+        if any(kw in code for kw in plot_keywords):
+            from app.tools import plot_chart
+            try:
+                return {'files': plot_chart(code, csv_path)}
+            except Exception as e:
+                # Plotting code will not work in the sandbox either; retry it like an execution error
+                error = f"{type(e).__name__}: {e}"
+                print(f"[Agent] Chart failed: {error}, retrying...")
+                continue
         print("[Agent] Executing code...")
         result = run_python(code, globals_dict={"csv_path": csv_path})
         print(f"[Agent] Execution completed (exit_code={result.get('exit_code')}, timeout={result.get('timeout')})")
@@ -127,7 +188,20 @@ def main(question: str, csv_path: str):
         raw_out = result.get("stdout", "")
         # Process stdout into Python object
         print(f"[Agent] Raw stdout:\n{raw_out}")
-        processed = post_process(raw_out)
+        if result.get("result_id"):
+            # Structured result from emit_result(): read the side channel instead of parsing stdout.
+            # Only enough rows to tell whether the table fits inline; the rest is paged from the store.
+            try:
+                processed = load_table(result["result_id"], limit=INLINE_ROWS + 1)
+            except Exception as e:
+                error = f"Could not read the table passed to emit_result: {e}"
+                print(f"[Agent] {error}, retrying...")
+                continue
+        elif result.get("stdout_spool"):
+            # Output exceeded the capture cap; a truncated repr cannot be parsed
+            processed = f"{raw_out.strip()}\n... (output truncated, full output in {result['stdout_spool']})"
+        else:
+            processed = post_process(raw_out)
         # Reflection & self-critique
         print("[Agent] Reflecting on result certainty...")
         try:
@@ -142,7 +216,7 @@ def main(question: str, csv_path: str):
                 "Code:\n```python\n" + code + "\n```\n"
                 f"Result: {processed}"
             )
-            refl = openai.ChatCompletion.create(
+            refl = chat(
                 model=CODE_MODEL,
                 messages=[
                     {"role": "system", "content": prompt_sys},
@@ -151,6 +225,7 @@ def main(question: str, csv_path: str):
                 max_tokens=128,
                 temperature=0,
                 timeout=1,
+                priority=PRIORITY_REFLECTION,
             )
             refl_text = refl.choices[0].message.content.strip()
             first = refl_text.splitlines()[0].strip().lower()
@@ -160,18 +235,9 @@ def main(question: str, csv_path: str):
                 return {'low_confidence': rationale}
         except Exception:
             pass
-        # Format DataFrame-like outputs as Markdown tables
         # Post-process for output formatting
         print("[Agent] Formatting final output...")
-        final = processed
-        try:
-            import pandas as _pd
-            if isinstance(processed, list) and processed and isinstance(processed[0], dict):
-                final = _pd.DataFrame(processed).to_markdown(index=False)
-            elif isinstance(processed, dict):
-                final = _pd.DataFrame(processed).to_markdown(index=False)
-        except Exception:
-            pass
+        final = format_result(processed, result.get("result_id"))
         set_cache(cache_key, final)
         return final
     return f"Failed to generate working code after {MAX_RETRIES} attempts. Last error:\n{error}"
\ No newline at end of file
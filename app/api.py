@@ -1,8 +1,16 @@
 """FastAPI API for CSV Data-Analyst Agent."""
 """FastAPI API for CSV Data-Analyst Agent."""
+import os
+import time
+import asyncio
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from app.agent import main as agent_main
+from app import jobs, llm, results
+
+# Seconds /ask waits for a worker before answering 202 with the job id
+ASK_TIMEOUT = float(os.getenv('AGENT_ASK_TIMEOUT', '300'))
+ASK_POLL_INTERVAL = 0.1
 
 class AskRequest(BaseModel):
     question: str
@@ -11,14 +19,83 @@ class AskRequest(BaseModel):
 class AskResponse(BaseModel):
     result: object
 
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    attempts: int = 0
+    error: object = None
+
 app = FastAPI()
 
 @app.post("/ask", response_model=AskResponse)
-def ask(request: AskRequest):
+async def ask(request: AskRequest):
+    """Enqueue the question and wait for a worker to answer it (see `app.worker`)."""
+    if not os.path.exists(request.csv_path):
+        raise HTTPException(status_code=400, detail=f"CSV file not found: {request.csv_path}")
+    job_id = jobs.enqueue(request.question, request.csv_path)
+    deadline = time.monotonic() + ASK_TIMEOUT
+    while True:
+        job = jobs.get_job(job_id)
+        if job["status"] == "done":
+            return {"result": job["result"]}
+        if job["status"] == "failed":
+            # The agent's own failure report is an answer, as it was before jobs existed
+            if job["result"] is not None:
+                return {"result": job["result"]}
+            raise HTTPException(status_code=400, detail=f"Error: {job['error']}")
+        if time.monotonic() >= deadline:
+            return JSONResponse(status_code=202, content={"job_id": job_id, "status": job["status"]})
+        await asyncio.sleep(ASK_POLL_INTERVAL)
+
+def _job_or_404(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+def submit_job(request: AskRequest):
+    if not os.path.exists(request.csv_path):
+        raise HTTPException(status_code=400, detail=f"CSV file not found: {request.csv_path}")
+    job_id = jobs.enqueue(request.question, request.csv_path)
+    # The question may have joined an identical job that is already running
+    return {"job_id": job_id, "status": jobs.get_job(job_id)["status"]}
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+def job_status(job_id: str):
+    job = _job_or_404(job_id)
+    return {"job_id": job["id"], "status": job["status"], "attempts": job["attempts"], "error": job["error"]}
+
+@app.get("/jobs/{job_id}/result", response_model=AskResponse)
+def job_result(job_id: str):
+    job = _job_or_404(job_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Job failed: {job['error']}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job not finished: {job['status']}")
+    return {"result": job["result"]}
+
+@app.get("/stats/llm")
+def llm_stats():
+    # LLM calls happen in the workers; report what each live worker last recorded
+    workers = jobs.worker_stats()
+    return {"total": llm.merge_stats(workers), "workers": workers}
+
+@app.get("/results/{result_id}")
+def result_page(result_id: str, offset: int = 0, limit: int = results.PAGE_SIZE):
+    if offset < 0 or limit <= 0:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit > 0")
+    try:
+        return results.read_page(result_id, offset, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.get("/results/{result_id}/stream")
+def result_stream(result_id: str, chunk_size: int = results.PAGE_SIZE):
+    if chunk_size <= 0:
+        raise HTTPException(status_code=400, detail="chunk_size must be > 0")
     try:
-        result = agent_main(request.question, request.csv_path)
+        results.result_path(result_id)
     except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error: {e}")
-    return {"result": result}
\ No newline at end of file
+        raise HTTPException(status_code=404, detail=str(e))
+    return StreamingResponse(results.iter_chunks(result_id, chunk_size), media_type="application/x-ndjson")
@@ -0,0 +1,108 @@
+"""
+Server-side downsampling for charts over large series.
+
+`downsample_figure` rewrites a rendered-but-unsaved matplotlib figure so that
+drawing cost and PNG size stay roughly constant regardless of dataset size:
+  - line plots longer than MAX_POINTS are reduced with LTTB
+    (Largest-Triangle-Three-Buckets), which keeps peaks and troughs;
+  - scatter plots and marker-only line plots (e.g. `plt.plot(x, y, 'o')`) with
+    more than MAX_POINTS markers are replaced by a binned hexagonal density plot.
+Histograms and bar charts already draw one artist per bin and are left as is.
+"""
+import os
+
+MAX_POINTS = int(os.getenv('AGENT_CHART_MAX_POINTS', '2000'))
+DENSITY_BINS = int(os.getenv('AGENT_CHART_DENSITY_BINS', '100'))
+
+def lttb(x, y, n_out: int):
+    """
+    Downsample the series (x, y) to `n_out` points with Largest-Triangle-Three-Buckets.
+    The first and last points are always kept. Returns (x, y) as numpy arrays.
+    """
+    import numpy as np
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+    every = (n - 2) / (n_out - 2)
+    idx = np.empty(n_out, dtype=int)
+    idx[0] = 0
+    idx[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        if next_end <= next_start:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Twice the triangle area between the previous pick, each candidate and the next bucket's mean
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        idx[i + 1] = a
+    return x[idx], y[idx]
+
+def _density(ax, x, y, bins: int, label: str, values=None, cmap=None):
+    """Draw (x, y) as a hexbin density over the current view, keeping the axis limits."""
+    import numpy as np
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+    kwargs = {'gridsize': bins, 'mincnt': 1, 'extent': (*xlim, *ylim), 'label': label}
+    if values is not None:
+        # Colour-mapped scatter: show the mean value per bin
+        ax.hexbin(x, y, C=np.asarray(values, dtype=float), reduce_C_function=np.mean, cmap=cmap, **kwargs)
+    else:
+        ax.hexbin(x, y, bins='log', cmap='viridis', **kwargs)
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+
+def _downsample_lines(ax, max_points: int, bins: int) -> int:
+    import numpy as np
+    changed = 0
+    for line in list(ax.get_lines()):
+        xy = line.get_xydata()
+        if len(xy) <= max_points:
+            continue
+        # LTTB needs finite values; gaps from NaNs are closed
+        xy = xy[np.isfinite(xy).all(axis=1)]
+        if line.get_linestyle() in ('None', 'none', '', ' '):
+            # Markers only: thinning the points would change the picture, so bin them instead
+            line.remove()
+            _density(ax, xy[:, 0], xy[:, 1], bins, line.get_label())
+        else:
+            x, y = lttb(xy[:, 0], xy[:, 1], max_points)
+            line.set_data(x, y)
+        changed += 1
+    return changed
+
+def _downsample_scatter(ax, max_points: int, bins: int) -> int:
+    import numpy as np
+    from matplotlib.collections import PathCollection
+    changed = 0
+    for coll in list(ax.collections):
+        if not isinstance(coll, PathCollection) or coll.get_offset_transform() is not ax.transData:
+            continue
+        offsets = np.asarray(coll.get_offsets(), dtype=float)
+        if len(offsets) <= max_points:
+            continue
+        values = coll.get_array()
+        if values is None or len(values) != len(offsets):
+            values = None
+        coll.remove()
+        _density(ax, offsets[:, 0], offsets[:, 1], bins, coll.get_label(), values, coll.get_cmap())
+        changed += 1
+    return changed
+
+def downsample_figure(fig, max_points: int = None, bins: int = None) -> int:
+    """
+    Downsample large line and scatter plots in every axes of `fig` in place.
+    Returns the number of artists that were reduced.
+    """
+    max_points = max_points or MAX_POINTS
+    bins = bins or DENSITY_BINS
+    changed = 0
+    for ax in fig.axes:
+        changed += _downsample_lines(ax, max_points, bins)
+        changed += _downsample_scatter(ax, max_points, bins)
+    return changed
@@ -0,0 +1,243 @@
+"""
+Rule-based compiler from common natural-language questions to pandas query plans.
+
+Handles questions such as "average num5 by cat1", "top 5 cat3 by count" or
+"sum of num1 where cat1 = 'A'" without an LLM round trip. Questions are parsed
+against the CSV header into a plan (filter -> groupby -> aggregate -> sort/limit)
+that runs vectorized on a cached DataFrame. Anything the rules cannot parse
+with confidence raises ValueError, like `app.oracle`.
+"""
+import os
+import re
+import csv
+import operator
+import threading
+from collections import OrderedDict
+
+# Number of parsed DataFrames kept in memory
+CACHE_SIZE = int(os.getenv('AGENT_DF_CACHE_SIZE', '4'))
+# Combined in-memory size of the cached DataFrames; larger frames are not cached at all
+CACHE_MEMORY_MB = int(os.getenv('AGENT_DF_CACHE_MEMORY_MB', '512'))
+
+_AGGS = {
+    'average': 'mean', 'avg': 'mean', 'mean': 'mean',
+    'sum': 'sum', 'total': 'sum',
+    'max': 'max', 'maximum': 'max', 'highest': 'max', 'largest': 'max',
+    'min': 'min', 'minimum': 'min', 'lowest': 'min', 'smallest': 'min',
+    'median': 'median',
+    'count': 'count', 'number': 'count',
+    'unique': 'nunique', 'distinct': 'nunique',
+}
+_NUMERIC_AGGS = {'mean', 'sum', 'max', 'min', 'median'}
+_AGG_RE = '|'.join(sorted(_AGGS, key=len, reverse=True))
+
+_PREFIX = re.compile(
+    r"^(?:what(?:'s| is| are| was)|show(?: me)?|give me|get|compute|calculate|find|list|tell me)\s+",
+    re.IGNORECASE,
+)
+_WHERE = re.compile(r'\s+(?:where|for which|when|with)\s+', re.IGNORECASE)
+_CONDITION = re.compile(
+    r'^(?P<col>.+?)\s*(?P<op>==|!=|>=|<=|=|>|<|\bis not\b|\bis\b|\bequals\b)\s*(?P<value>.+)$',
+    re.IGNORECASE,
+)
+_TOP_COUNT = re.compile(
+    r'^(?P<dir>top|bottom|first)\s+(?P<n>\d+)\s+(?P<group>.+?)\s+by\s+(?:count|frequency|occurrences)$',
+    re.IGNORECASE,
+)
+_TOP_AGG = re.compile(
+    rf'^(?P<dir>top|bottom|first)\s+(?P<n>\d+)\s+(?P<group>.+?)\s+by\s+(?:(?P<agg>{_AGG_RE})\s+(?:of\s+)?)?(?P<col>.+)$',
+    re.IGNORECASE,
+)
+_COUNT_BY = re.compile(
+    r'^(?:count|number of rows|row count|how many rows)\s+(?:by|per|for each)\s+(?P<group>.+)$',
+    re.IGNORECASE,
+)
+_AGG_BY = re.compile(
+    rf'^(?P<agg>{_AGG_RE})\s+(?:value\s+)?(?:of\s+)?(?P<col>.+?)\s+(?:by|per|for each|grouped by)\s+(?P<group>.+)$',
+    re.IGNORECASE,
+)
+_AGG = re.compile(rf'^(?P<agg>{_AGG_RE})\s+(?:value\s+)?(?:of\s+)?(?P<col>.+)$', re.IGNORECASE)
+_COUNT = re.compile(r'^(?:count|number of rows|row count|how many rows(?: are there)?)$', re.IGNORECASE)
+
+_OPS = {
+    '==': operator.eq, '!=': operator.ne,
+    '>': operator.gt, '>=': operator.ge,
+    '<': operator.lt, '<=': operator.le,
+}
+
+_df_cache = OrderedDict()  # key -> (DataFrame, bytes)
+_cache_lock = threading.Lock()
+
+def _cache_bytes() -> int:
+    return sum(nbytes for _, nbytes in _df_cache.values())
+
+def load_dataframe(csv_path: str):
+    """
+    Return the parsed DataFrame for `csv_path`, reusing it while the file is unchanged.
+    The cache holds at most CACHE_SIZE frames and CACHE_MEMORY_MB in total, evicting
+    least-recently-used frames first.
+    """
+    import pandas as pd
+    st = os.stat(csv_path)
+    key = (os.path.abspath(csv_path), st.st_mtime_ns, st.st_size)
+    with _cache_lock:
+        entry = _df_cache.get(key)
+        if entry is not None:
+            _df_cache.move_to_end(key)
+            return entry[0]
+    df = pd.read_csv(csv_path)
+    nbytes = int(df.memory_usage(deep=True).sum())
+    budget = CACHE_MEMORY_MB * 1024 * 1024
+    if nbytes > budget:
+        return df
+    with _cache_lock:
+        _df_cache[key] = (df, nbytes)
+        while len(_df_cache) > CACHE_SIZE or _cache_bytes() > budget:
+            _df_cache.popitem(last=False)
+    return df
+
+def _normalize(name: str) -> str:
+    name = re.sub(r'[\s_\-]+', ' ', name.strip().strip('`"\'').lower())
+    return re.sub(r'^the\s+', '', name)
+
+def _resolve_column(name: str, columns) -> str:
+    target = _normalize(name)
+    matches = [c for c in columns if _normalize(str(c)) == target]
+    if len(matches) != 1:
+        raise ValueError(f"Unknown column: {name}")
+    return matches[0]
+
+def _parse_value(text: str):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '"\'':
+        return text[1:-1]
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def _parse_filters(text: str, columns) -> list:
+    filters = []
+    for part in re.split(r'\s+and\s+', text, flags=re.IGNORECASE):
+        m = _CONDITION.match(part.strip())
+        if not m:
+            raise ValueError(f"Unsupported condition: {part}")
+        op = m.group('op').lower()
+        op = {'=': '==', 'is': '==', 'equals': '==', 'is not': '!='}.get(op, op)
+        filters.append((_resolve_column(m.group('col'), columns), op, _parse_value(m.group('value'))))
+    return filters
+
+def compile_question(question: str, columns) -> dict:
+    """
+    Parse `question` against the header `columns` into a query plan dict with keys
+    filters, groupby, agg, column, sort ('asc'/'desc'/None) and limit.
+    Raises ValueError if the question does not match a supported pattern.
+    """
+    text = question.strip().rstrip('?.!').strip()
+    text = _PREFIX.sub('', text)
+    text = re.sub(r'^the\s+', '', text, flags=re.IGNORECASE)
+    parts = _WHERE.split(text, maxsplit=1)
+    main = parts[0].strip()
+    filters = _parse_filters(parts[1], columns) if len(parts) > 1 else []
+    plan = {'filters': filters, 'groupby': None, 'agg': None, 'column': None, 'sort': None, 'limit': None}
+    m = _TOP_COUNT.match(main)
+    if m:
+        plan.update(groupby=_resolve_column(m.group('group'), columns), agg='size',
+                    sort='asc' if m.group('dir').lower() == 'bottom' else 'desc', limit=int(m.group('n')))
+        return plan
+    m = _COUNT_BY.match(main)
+    if m:
+        plan.update(groupby=_resolve_column(m.group('group'), columns), agg='size')
+        return plan
+    m = _TOP_AGG.match(main)
+    if m:
+        plan.update(groupby=_resolve_column(m.group('group'), columns),
+                    agg=_AGGS[m.group('agg').lower()] if m.group('agg') else 'sum',
+                    column=_resolve_column(m.group('col'), columns),
+                    sort='asc' if m.group('dir').lower() == 'bottom' else 'desc', limit=int(m.group('n')))
+        return plan
+    m = _AGG_BY.match(main)
+    if m:
+        plan.update(groupby=_resolve_column(m.group('group'), columns), agg=_AGGS[m.group('agg').lower()],
+                    column=_resolve_column(m.group('col'), columns))
+        return plan
+    if filters and _COUNT.match(main):
+        plan.update(agg='size')
+        return plan
+    m = _AGG.match(main)
+    if m:
+        plan.update(agg=_AGGS[m.group('agg').lower()], column=_resolve_column(m.group('col'), columns))
+        return plan
+    raise ValueError(f"Unsupported question: {question}")
+
+def _mask(df, column, op, value):
+    import pandas as pd
+    series = df[column]
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        if isinstance(value, str):
+            raise ValueError(f"Cannot compare numeric column {column} with {value!r}")
+    elif pd.api.types.is_bool_dtype(series):
+        if str(value).lower() not in ('true', 'false'):
+            raise ValueError(f"Cannot compare boolean column {column} with {value!r}")
+        value = str(value).lower() == 'true'
+    elif op in ('==', '!='):
+        series = series.astype(str)
+        value = str(value)
+    else:
+        raise ValueError(f"Cannot order-compare non-numeric column {column}")
+    return _OPS[op](series, value)
+
+def _scalar(value):
+    return value.item() if hasattr(value, 'item') else value
+
+def execute(plan: dict, df):
+    """
+    Run a query plan on `df`. Returns a scalar for ungrouped aggregates,
+    otherwise a DataFrame (group column and value) ordered by group or by the sort key.
+    Raises ValueError when the filters match no rows or the aggregate is undefined,
+    except for ungrouped counts, which are 0.
+    """
+    import pandas as pd
+    for column, op, value in plan['filters']:
+        df = df[_mask(df, column, op, value)]
+    agg = plan['agg']
+    column = plan['column']
+    if agg in _NUMERIC_AGGS and not pd.api.types.is_numeric_dtype(df[column]):
+        raise ValueError(f"Column {column} is not numeric")
+    if plan['groupby'] is None and agg == 'size':
+        return int(len(df))
+    if df.empty:
+        raise ValueError("No rows match the filters")
+    if plan['groupby'] is None:
+        value = _scalar(getattr(df[column], agg)())
+        if pd.isna(value):
+            raise ValueError(f"No {agg} of {column}: all matching values are missing")
+        return value
+    grouped = df.groupby(plan['groupby'])
+    if agg == 'size':
+        out = grouped.size()
+        out.name = 'count'
+    else:
+        out = getattr(grouped[column], agg)()
+        out.name = column if column != plan['groupby'] else f"{agg}_{column}"
+    if plan['sort']:
+        # Stable sort so ties keep group order
+        out = out.sort_values(ascending=plan['sort'] == 'asc', kind='stable')
+    if plan['limit']:
+        out = out.head(plan['limit'])
+    return out.reset_index()
+
+def answer_question(question: str, csv_path: str):
+    """
+    Answer `question` on the CSV at `csv_path` with a compiled query plan.
+    Raises ValueError when the question is not confidently understood.
+    """
+    # Parse against the header alone so unsupported questions never pay for loading the data
+    with open(csv_path, newline='') as f:
+        header = next(csv.reader(f), [])
+    plan = compile_question(question, header)
+    return execute(plan, load_dataframe(csv_path))
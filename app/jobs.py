@@ -0,0 +1,225 @@
+"""Durable SQLite-backed job queue for agent work.
+
+Jobs are enqueued by the API and leased by worker processes (see `app.worker`),
+which may run on other hosts as long as they share the database file.
+A leased job that is not completed before its visibility timeout becomes
+available again and is retried until `max_attempts` is exhausted.
+
+Identical questions about the same dataset (same path, size and modification
+time) that arrive while one is queued or running share that job, so every
+worker process together answers them once.
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+
+DEFAULT_VISIBILITY_TIMEOUT = int(os.getenv('AGENT_JOB_VISIBILITY_TIMEOUT', '300'))
+DEFAULT_MAX_ATTEMPTS = int(os.getenv('AGENT_JOB_MAX_ATTEMPTS', '3'))
+# Attach identical in-flight questions to the running job instead of queueing them again
+COALESCE = os.getenv('AGENT_JOB_COALESCE', '1') != '0'
+
+# Initialize SQLite database for the job queue
+_DB_PATH = os.getenv('AGENT_QUEUE_DB', os.path.join(os.getcwd(), 'agent_jobs.db'))
+# Autocommit mode so leases can take an explicit write lock across processes
+_conn = sqlite3.connect(_DB_PATH, check_same_thread=False, isolation_level=None, timeout=30)
+_conn.execute(
+    'CREATE TABLE IF NOT EXISTS jobs ('
+    'id TEXT PRIMARY KEY, '
+    'question TEXT, '
+    'csv_path TEXT, '
+    'status TEXT, '
+    'attempts INTEGER, '
+    'max_attempts INTEGER, '
+    'worker TEXT, '
+    'lease_expires REAL, '
+    'result TEXT, '
+    'error TEXT, '
+    'created REAL, '
+    'updated REAL'
+    ')'
+)
+_conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)')
+if 'dedupe_key' not in [row[1] for row in _conn.execute('PRAGMA table_info(jobs)')]:
+    # Databases created before jobs were coalesced
+    _conn.execute('ALTER TABLE jobs ADD COLUMN dedupe_key TEXT')
+_conn.execute('CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status)')
+# Latest per-worker metrics (e.g. LLM gateway stats), reported by each worker process
+_conn.execute(
+    'CREATE TABLE IF NOT EXISTS workers ('
+    'id TEXT PRIMARY KEY, '
+    'stats TEXT, '
+    'updated REAL'
+    ')'
+)
+_lock = threading.Lock()
+
+_COLUMNS = (
+    'id', 'question', 'csv_path', 'status', 'attempts', 'max_attempts',
+    'worker', 'lease_expires', 'result', 'error', 'created', 'updated',
+)
+
+def _row_to_job(row):
+    job = dict(zip(_COLUMNS, row))
+    if job['result'] is not None:
+        try:
+            job['result'] = json.loads(job['result'])
+        except json.JSONDecodeError:
+            pass
+    return job
+
+def _dedupe_key(question: str, csv_path: str):
+    """Identify a question about a dataset version, or None if the file cannot be read."""
+    try:
+        st = os.stat(csv_path)
+    except OSError:
+        return None
+    ident = f"{question}\0{os.path.abspath(csv_path)}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha1(ident.encode()).hexdigest()
+
+def enqueue(question: str, csv_path: str, max_attempts: int = None) -> str:
+    """
+    Add a job to the queue and return its id. If the same question about the
+    same dataset is already queued or running, return that job's id instead.
+    """
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    attempts = max_attempts if max_attempts is not None else DEFAULT_MAX_ATTEMPTS
+    key = _dedupe_key(question, csv_path) if COALESCE else None
+    with _lock:
+        _conn.execute('BEGIN IMMEDIATE')
+        try:
+            if key is not None:
+                cur = _conn.execute(
+                    "SELECT id FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running') LIMIT 1",
+                    (key,)
+                )
+                row = cur.fetchone()
+                if row is not None:
+                    _conn.execute('COMMIT')
+                    return row[0]
+            _conn.execute(
+                'INSERT INTO jobs (id, question, csv_path, status, attempts, max_attempts, created, updated, '
+                'dedupe_key) VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?)',
+                (job_id, question, csv_path, 'queued', attempts, now, now, key)
+            )
+            _conn.execute('COMMIT')
+        except Exception:
+            _conn.execute('ROLLBACK')
+            raise
+    return job_id
+
+def get_job(job_id: str):
+    """Return the job as a dict, or None if it does not exist."""
+    with _lock:
+        cur = _conn.execute(f'SELECT {", ".join(_COLUMNS)} FROM jobs WHERE id = ?', (job_id,))
+        row = cur.fetchone()
+    return _row_to_job(row) if row else None
+
+def lease(worker_id: str, visibility_timeout: int = None):
+    """
+    Claim the oldest available job for `worker_id`.
+
+    A job is available if it is queued, or if it is running but its lease has
+    expired. Expired jobs that already used all attempts are marked failed.
+    Returns the leased job as a dict, or None if the queue is empty.
+    """
+    timeout = visibility_timeout if visibility_timeout is not None else DEFAULT_VISIBILITY_TIMEOUT
+    now = time.time()
+    with _lock:
+        _conn.execute('BEGIN IMMEDIATE')
+        try:
+            _conn.execute(
+                "UPDATE jobs SET status = 'failed', error = COALESCE(error, 'Lease expired'), "
+                'worker = NULL, lease_expires = NULL, updated = ? '
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts",
+                (now, now)
+            )
+            cur = _conn.execute(
+                'SELECT id FROM jobs '
+                "WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                'ORDER BY created LIMIT 1',
+                (now,)
+            )
+            row = cur.fetchone()
+            if row is None:
+                _conn.execute('COMMIT')
+                return None
+            _conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, "
+                'lease_expires = ?, updated = ? WHERE id = ?',
+                (worker_id, now + timeout, now, row[0])
+            )
+            cur = _conn.execute(f'SELECT {", ".join(_COLUMNS)} FROM jobs WHERE id = ?', (row[0],))
+            job = cur.fetchone()
+            _conn.execute('COMMIT')
+        except Exception:
+            _conn.execute('ROLLBACK')
+            raise
+    return _row_to_job(job)
+
+def complete(job_id: str, worker_id: str, result) -> bool:
+    """
+    Store the result of a job leased by `worker_id`.
+    Returns False if the lease was lost to another worker.
+    """
+    text = json.dumps(result)
+    with _lock:
+        cur = _conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, worker = NULL, "
+            "lease_expires = NULL, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (text, time.time(), job_id, worker_id)
+        )
+    return cur.rowcount == 1
+
+def extend(job_id: str, worker_id: str, visibility_timeout: int = None) -> bool:
+    """
+    Push back the lease expiry of a running job held by `worker_id`.
+    Returns False if the lease was lost to another worker.
+    """
+    timeout = visibility_timeout if visibility_timeout is not None else DEFAULT_VISIBILITY_TIMEOUT
+    now = time.time()
+    with _lock:
+        cur = _conn.execute(
+            "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (now + timeout, now, job_id, worker_id)
+        )
+    return cur.rowcount == 1
+
+def fail(job_id: str, worker_id: str, error: str, retry: bool = True, result=None) -> bool:
+    """
+    Record a failed attempt. The job is re-queued while attempts remain (and
+    `retry` is set), otherwise it is marked failed. `result` keeps the agent's
+    own report of the failure, if any. Returns False if the lease was lost.
+    """
+    text = json.dumps(result) if result is not None else None
+    with _lock:
+        cur = _conn.execute(
+            "UPDATE jobs SET status = CASE WHEN ? OR attempts >= max_attempts THEN 'failed' ELSE 'queued' END, "
+            'error = ?, result = ?, worker = NULL, lease_expires = NULL, updated = ? '
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (not retry, error, text, time.time(), job_id, worker_id)
+        )
+    return cur.rowcount == 1
+
+def record_worker_stats(worker_id: str, stats: dict):
+    """Store the latest metrics reported by `worker_id`."""
+    with _lock:
+        _conn.execute(
+            'INSERT OR REPLACE INTO workers (id, stats, updated) VALUES (?, ?, ?)',
+            (worker_id, json.dumps(stats), time.time())
+        )
+
+def worker_stats(max_age: float = 60) -> list:
+    """Return metrics of workers that reported within the last `max_age` seconds."""
+    with _lock:
+        cur = _conn.execute(
+            'SELECT id, stats, updated FROM workers WHERE updated >= ? ORDER BY id',
+            (time.time() - max_age,)
+        )
+        rows = cur.fetchall()
+    return [{'worker': wid, 'updated': updated, 'stats': json.loads(stats)} for wid, stats, updated in rows]
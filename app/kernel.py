@@ -0,0 +1,184 @@
+"""
+Sandbox kernel process for stateful per-dataset sessions (see `app.sessions`).
+
+Runs as a standalone script in the session's working directory. The first
+message on stdin names the CSV to load; the DataFrame is parsed once, and every
+later message runs a code snippet in a forked child of the loaded kernel. Each
+child sees the parsed `df` without copying it, and whatever it changes (the
+frame, imported modules, monkeypatches) dies with it. Snippets run
+concurrently; one that overruns its timeout is killed without touching the
+kernel or its neighbours.
+
+Messages and replies are newline-delimited JSON tagged with the request id;
+snippet output goes to the files named in each request so the protocol channel
+stays clean.
+"""
+import os
+import sys
+import json
+import math
+import time
+import select
+import signal
+import resource
+import traceback
+
+# Seconds between checks for finished or overdue snippets while any are running
+_POLL = 0.05
+
+def _rss_kb() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+def _reply(**msg):
+    msg['rss_kb'] = _rss_kb()
+    sys.stdout.write(json.dumps(msg) + '\n')
+    sys.stdout.flush()
+
+class _Lines:
+    """Non-blocking newline-delimited JSON reader over a file descriptor."""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.buf = b''
+        self.eof = False
+
+    def fill(self):
+        data = os.read(self.fd, 65536)
+        if not data:
+            self.eof = True
+        self.buf += data
+
+    def pop(self):
+        if b'\n' not in self.buf:
+            return None
+        line, self.buf = self.buf.split(b'\n', 1)
+        return json.loads(line)
+
+def _vm_size_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmSize:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _limit_resources(timeout: float, memory_mb: int):
+    """Cap the child's CPU time and, where measurable, its additional address space."""
+    # A backstop only: the wall-clock deadline normally stops the snippet first
+    cpu = math.ceil(timeout) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+    vm_kb = _vm_size_kb()
+    if memory_mb and vm_kb is not None:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        soft = (vm_kb + memory_mb * 1024) * 1024
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+def _child(request: dict, init: dict, base, load_error, helpers: dict, allowed: dict):
+    """Run one snippet in the forked child and exit with its status."""
+    exit_code = 1
+    try:
+        os.chdir(request['cwd'])
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        out = os.open(request['stdout'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        err = os.open(request['stderr'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.dup2(devnull, 0)
+        os.dup2(out, 1)
+        os.dup2(err, 2)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        _limit_resources(request['timeout'], init.get('memory_mb', 0))
+        import pandas as pd
+        namespace = {'__builtins__': dict(allowed), 'emit_result': helpers['emit_result'], 'pd': pd}
+        namespace.update(request.get('globals', {}))
+        if base is not None:
+            namespace['df'] = base
+        exit_code = 0
+        try:
+            exec(compile(request['code'], 'script.py', 'exec'), namespace)
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except BaseException as e:
+            # Skip the kernel's own frame so tracebacks match a standalone script
+            traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+            exit_code = 1
+        if exit_code and load_error:
+            sys.stderr.write(f"Note: df could not be preloaded from {init['csv_path']}:\n{load_error}")
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code & 0xFF)
+
+def main():
+    lines = _Lines(0)
+    init = None
+    while init is None and not lines.eof:
+        lines.fill()
+        init = lines.pop()
+    if init is None:
+        return
+    import builtins
+    import pandas as pd
+    try:
+        # Copy-on-Write keeps the forked children's pages shared with the parent
+        pd.set_option('mode.copy_on_write', True)
+    except Exception:
+        pass
+    base = load_error = None
+    try:
+        base = pd.read_csv(init['csv_path'])
+    except Exception:
+        # Snippets still run (they may read the file themselves); failures carry this note
+        load_error = traceback.format_exc()
+    helpers = {}
+    exec(init['writer'], helpers)
+    allowed = {name: getattr(builtins, name) for name in init['builtins']}
+    _reply(ok=True, load_error=load_error)
+
+    children = {}  # pid -> (request id, deadline)
+    while not lines.eof:
+        if b'\n' in lines.buf:
+            wait = 0
+        else:
+            wait = _POLL if children else None
+        ready, _, _ = select.select([lines.fd], [], [], wait)
+        if ready:
+            lines.fill()
+        request = lines.pop()
+        while request is not None:
+            pid = os.fork()
+            if pid == 0:
+                _child(request, init, base, load_error, helpers, allowed)
+            children[pid] = (request['id'], time.monotonic() + request['timeout'])
+            request = lines.pop()
+        # Reap finished snippets and kill overdue ones
+        now = time.monotonic()
+        for pid, (req_id, deadline) in list(children.items()):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                del children[pid]
+                exit_code = os.waitstatus_to_exitcode(status)
+                if exit_code == -signal.SIGXCPU:
+                    _reply(id=req_id, exit_code=None, timeout=True)
+                else:
+                    _reply(id=req_id, exit_code=exit_code, timeout=False)
+            elif now > deadline:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                del children[pid]
+                _reply(id=req_id, exit_code=None, timeout=True)
+    # The host went away: do not leave snippets running
+    for pid in children:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""LLM gateway: request scheduling for OpenAI chat completions.
+
+All agent calls to the model go through `chat`, which
+  - coalesces concurrent identical requests into a single API call (single-flight),
+  - admits requests through a token-bucket rate limiter, serving waiters by priority
+    (code generation ahead of reflection),
+  - reuses a pooled HTTP session across calls,
+  - retries rate-limit and transient errors with jittered exponential backoff.
+Queue depth and wait times are available via `stats()`.
+
+All of this is per process: each worker process (see `app.worker`) has its own
+bucket and in-flight table, so the effective request rate is AGENT_LLM_RPS times
+the number of worker processes. Identical questions from concurrent users are
+coalesced across processes one level up, by `app.jobs`, which hands them all the
+same job. Workers report their `stats()` to the job database, and the API
+serves the per-worker figures merged by `merge_stats`.
+"""
+
+import os
+import json
+import time
+import heapq
+import random
+import itertools
+import threading
+import openai
+
+PRIORITY_CODE = 0
+PRIORITY_REFLECTION = 10
+
+# Requests per second admitted to the API by this process (0 disables rate limiting)
+RATE_LIMIT = float(os.getenv('AGENT_LLM_RPS', '5'))
+BURST = int(os.getenv('AGENT_LLM_BURST', '10'))
+MAX_RETRIES = int(os.getenv('AGENT_LLM_MAX_RETRIES', '4'))
+BACKOFF_BASE = float(os.getenv('AGENT_LLM_BACKOFF_BASE', '0.5'))
+BACKOFF_MAX = float(os.getenv('AGENT_LLM_BACKOFF_MAX', '8'))
+POOL_SIZE = int(os.getenv('AGENT_LLM_POOL_SIZE', '20'))
+
+_RETRYABLE = {'RateLimitError', 'APIConnectionError', 'ServiceUnavailableError', 'Timeout', 'APITimeoutError'}
+
+def _init_session():
+    """Share one pooled HTTP session across all OpenAI calls (legacy client hook)."""
+    if getattr(openai, 'requestssession', None) is not None:
+        return
+    try:
+        import requests
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        return
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    openai.requestssession = session
+
+_init_session()
+
+class _TokenBucket:
+    """Token-bucket rate limiter whose waiters are admitted in priority order."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.admitted = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority: int) -> float:
+        """Block until a token is available for this caller; return seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        start = time.monotonic()
+        with self._cond:
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    self._refill()
+                    if self._waiters[0] == entry and self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    if self._waiters[0] == entry:
+                        timeout = (1 - self.tokens) / self.rate
+                    else:
+                        timeout = None
+                    self._cond.wait(timeout)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.admitted += 1
+        return waited
+
+class _Call:
+    """An in-flight request shared by all identical concurrent callers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+_bucket = _TokenBucket(RATE_LIMIT, BURST)
+_inflight = {}
+_inflight_lock = threading.Lock()
+_coalesced = 0
+
+def _is_retryable(exc: Exception) -> bool:
+    if type(exc).__name__ in _RETRYABLE:
+        return True
+    status = getattr(exc, 'http_status', None) or getattr(exc, 'status_code', None)
+    return status == 429 or (isinstance(status, int) and status >= 500)
+
+def _backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff delay for retry number `attempt` (0-based)."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+def _send(priority: int, kwargs: dict):
+    attempt = 0
+    while True:
+        _bucket.acquire(priority)
+        try:
+            return openai.ChatCompletion.create(**kwargs)
+        except Exception as e:
+            if attempt >= MAX_RETRIES or not _is_retryable(e):
+                raise
+            delay = _backoff(attempt)
+            print(f"[LLM] {type(e).__name__}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+
+def chat(messages: list, model: str, max_tokens: int, temperature: float = 0,
+         timeout: float = None, priority: int = PRIORITY_CODE):
+    """
+    Send a chat completion request through the gateway and return the API response.
+    Identical concurrent requests share one call; errors propagate to every caller.
+    """
+    global _coalesced
+    kwargs = {'model': model, 'messages': messages, 'max_tokens': max_tokens, 'temperature': temperature}
+    key = json.dumps(kwargs, sort_keys=True)
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _Call()
+        else:
+            _coalesced += 1
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+    try:
+        call.result = _send(priority, kwargs)
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        call.done.set()
+    return call.result
+
+def stats() -> dict:
+    """Return this process's scheduler metrics: queue depth, in-flight calls and wait times."""
+    with _inflight_lock:
+        inflight = len(_inflight)
+        coalesced = _coalesced
+    with _bucket._cond:
+        admitted = _bucket.admitted
+        total_wait = _bucket.total_wait
+        max_wait = _bucket.max_wait
+        depth = len(_bucket._waiters)
+    return {
+        'queue_depth': depth,
+        'inflight': inflight,
+        'coalesced': coalesced,
+        'admitted': admitted,
+        'avg_wait': total_wait / admitted if admitted else 0.0,
+        'max_wait': max_wait,
+    }
+
+def merge_stats(workers: list) -> dict:
+    """Combine per-worker `stats()` reports (as returned by `jobs.worker_stats`) into totals."""
+    totals = {'workers': len(workers), 'queue_depth': 0, 'inflight': 0, 'coalesced': 0,
+              'admitted': 0, 'avg_wait': 0.0, 'max_wait': 0.0}
+    total_wait = 0.0
+    for w in workers:
+        st = w['stats']
+        for key in ('queue_depth', 'inflight', 'coalesced', 'admitted'):
+            totals[key] += st.get(key, 0)
+        total_wait += st.get('avg_wait', 0.0) * st.get('admitted', 0)
+        totals['max_wait'] = max(totals['max_wait'], st.get('max_wait', 0.0))
+    if totals['admitted']:
+        totals['avg_wait'] = total_wait / totals['admitted']
+    return totals
@@ -0,0 +1,228 @@
+"""Structured result side channel and pagination for large tabular results.
+
+Sandboxed code hands tables back with `emit_result(obj)` (defined in the sandbox
+header, see `app.tools`), which writes a `.npz` archive with one array per column.
+The host unpacks each archive into a result directory holding one `.npy` file
+per column, so pages can be read through memory maps without loading the whole
+table. Arrays are always loaded with `allow_pickle=False`, so nothing executable
+crosses back from the sandbox.
+
+Results live under `output_dir()/results`; point AGENT_OUTPUT_DIR at a shared
+directory when workers run on other hosts than the API. Stored results and
+spooled output older than RETENTION seconds are deleted, and their ids stop
+resolving.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import zipfile
+
+RESULT_FILE = '_result.npz'
+PAGE_SIZE = int(os.getenv('AGENT_RESULT_PAGE_SIZE', '100'))
+# Tables with more rows than this are returned as a paginated handle instead of inline Markdown
+INLINE_ROWS = int(os.getenv('AGENT_INLINE_ROWS', '50'))
+
+# Seconds stored results and spooled output are kept (0 keeps them forever)
+RETENTION = float(os.getenv('AGENT_OUTPUT_TTL', str(24 * 3600)))
+# Minimum seconds between two cleanup passes in one process
+CLEANUP_INTERVAL = 60
+
+_RESULT_ID = re.compile(r'^[0-9a-f]{32}$')
+_MEMBER = re.compile(r'^(?:__columns__|c\d+)\.npy$')
+_SPOOL = re.compile(r'^[0-9a-f]{32}_std(?:out|err)\.txt$')
+_last_cleanup = 0.0
+
+# Source for the sandbox-side writer; injected into every script before builtins are restricted.
+# It must avoid comprehensions, which would resolve builtins from the restricted namespace.
+# Columns that only convert to object arrays (strings, tz-aware datetimes, nullable values)
+# are stored as numbers with NaN or as strings, so they load without pickle.
+WRITER_SOURCE = '''
+def _result_arrays(obj):
+    import numpy as _np
+    import pandas as _pd
+    if isinstance(obj, _pd.Series):
+        obj = obj.to_frame()
+    elif not isinstance(obj, _pd.DataFrame):
+        obj = _pd.DataFrame(obj)
+    if not isinstance(obj.index, _pd.RangeIndex):
+        obj = obj.reset_index()
+    arrays = {'__columns__': _np.array(obj.columns.map(str), dtype=str)}
+    for i in range(obj.shape[1]):
+        col = obj.iloc[:, i]
+        arr = col.to_numpy()
+        if arr.dtype == object and col.dtype.kind in 'iuf':
+            arr = col.to_numpy(dtype='float64', na_value=_np.nan)
+        if arr.dtype == object:
+            arr = col.astype(str).to_numpy(dtype=str)
+        arrays['c%%d' %% i] = arr
+    return arrays
+
+def emit_result(obj, _path=%r):
+    import numpy as _np
+    arrays = _result_arrays(obj)
+    with open(_path, 'wb') as _f:
+        _np.savez(_f, **arrays)
+''' % RESULT_FILE
+
+# Host-side copy of the writer, used to store tables computed outside the sandbox
+_writer = {}
+exec(WRITER_SOURCE, _writer)
+
+def output_dir() -> str:
+    """Directory where run artifacts (charts, spooled output, results) are stored."""
+    return os.path.abspath(os.getenv('AGENT_OUTPUT_DIR') or os.path.join(os.getcwd(), 'agent_outputs'))
+
+def _results_dir() -> str:
+    return os.path.join(output_dir(), 'results')
+
+def _expired(path: str, now: float = None) -> bool:
+    if not RETENTION:
+        return False
+    try:
+        return (now or time.time()) - os.path.getmtime(path) > RETENTION
+    except OSError:
+        return True
+
+def cleanup() -> int:
+    """Delete stored results and spooled output older than RETENTION; returns how many were removed."""
+    global _last_cleanup
+    _last_cleanup = now = time.time()
+    removed = 0
+    if not RETENTION:
+        return removed
+    for base, pattern, is_dir in ((_results_dir(), _RESULT_ID, True), (output_dir(), _SPOOL, False)):
+        try:
+            names = os.listdir(base)
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(base, name)
+            if not pattern.match(name) or not _expired(path, now):
+                continue
+            if is_dir:
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+            removed += 1
+    return removed
+
+def maybe_cleanup():
+    """Run `cleanup` if this process has not done so in the last CLEANUP_INTERVAL seconds."""
+    if time.time() - _last_cleanup >= CLEANUP_INTERVAL:
+        cleanup()
+
+def result_path(result_id: str) -> str:
+    """Map a result id to its directory; raises ValueError for unknown or expired ids."""
+    if not _RESULT_ID.match(result_id or ''):
+        raise ValueError(f"Invalid result id: {result_id}")
+    path = os.path.join(_results_dir(), result_id)
+    if not os.path.isdir(path):
+        raise ValueError(f"Result not found: {result_id}")
+    if _expired(path):
+        shutil.rmtree(path, ignore_errors=True)
+        raise ValueError(f"Result expired: {result_id}")
+    return path
+
+def _open_columns(result_id: str):
+    """Return (column names, memory-mapped column arrays) of a stored result."""
+    import numpy as np
+    path = result_path(result_id)
+    names = np.load(os.path.join(path, '__columns__.npy'), allow_pickle=False)
+    arrays = [np.load(os.path.join(path, f'c{i}.npy'), mmap_mode='r', allow_pickle=False)
+              for i in range(len(names))]
+    return [str(n) for n in names], arrays
+
+def _check(result_id: str):
+    """Make sure a stored result is readable and rectangular."""
+    _, arrays = _open_columns(result_id)
+    if len({len(a) for a in arrays}) > 1:
+        raise ValueError('Result columns have different lengths')
+
+def store_result(archive: str) -> str:
+    """
+    Unpack an `emit_result` archive into the result store and return its id.
+    The archive is removed. Raises ValueError if it is not a readable table.
+    """
+    maybe_cleanup()
+    result_id = uuid.uuid4().hex
+    dest = os.path.join(_results_dir(), result_id)
+    os.makedirs(dest)
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            for member in zf.namelist():
+                if not _MEMBER.match(member):
+                    raise ValueError(f"Unexpected entry in result archive: {member}")
+                with zf.open(member) as src, open(os.path.join(dest, member), 'wb') as out:
+                    shutil.copyfileobj(src, out)
+        _check(result_id)
+    except Exception as e:
+        shutil.rmtree(dest, ignore_errors=True)
+        raise ValueError(f"Invalid result archive: {e}") from e
+    finally:
+        os.remove(archive)
+    return result_id
+
+def save_table(df) -> str:
+    """Store a DataFrame computed on the host and return its result id."""
+    import numpy as np
+    maybe_cleanup()
+    result_id = uuid.uuid4().hex
+    dest = os.path.join(_results_dir(), result_id)
+    os.makedirs(dest)
+    for name, arr in _writer['_result_arrays'](df).items():
+        np.save(os.path.join(dest, f'{name}.npy'), arr, allow_pickle=False)
+    return result_id
+
+def table_rows(result_id: str) -> int:
+    """Number of rows in a stored result."""
+    _, arrays = _open_columns(result_id)
+    return len(arrays[0]) if arrays else 0
+
+def load_table(result_id: str, offset: int = 0, limit: int = None):
+    """Load rows `[offset, offset + limit)` of a stored result (all rows if `limit` is None)."""
+    import numpy as np
+    import pandas as pd
+    names, arrays = _open_columns(result_id)
+    stop = None if limit is None else offset + limit
+    # Copy only the requested slice out of the memory maps
+    df = pd.DataFrame({i: np.array(a[offset:stop]) for i, a in enumerate(arrays)})
+    df.columns = names
+    return df
+
+def _records(df) -> list:
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+def summarize(result_id: str) -> dict:
+    """Handle returned to callers for a large table: shape, columns and a preview."""
+    preview = load_table(result_id, 0, INLINE_ROWS)
+    return {
+        'result_id': result_id,
+        'rows': table_rows(result_id),
+        'columns': list(preview.columns),
+        'preview': _records(preview),
+    }
+
+def read_page(result_id: str, offset: int = 0, limit: int = None) -> dict:
+    """Return rows `[offset, offset + limit)` of a stored result as JSON records."""
+    limit = PAGE_SIZE if limit is None else limit
+    return {
+        'result_id': result_id,
+        'offset': offset,
+        'limit': limit,
+        'total': table_rows(result_id),
+        'rows': _records(load_table(result_id, offset, limit)),
+    }
+
+def iter_chunks(result_id: str, chunk_size: int = None):
+    """Yield a stored result as newline-delimited JSON, `chunk_size` rows at a time."""
+    chunk_size = chunk_size or PAGE_SIZE
+    for start in range(0, table_rows(result_id), chunk_size):
+        lines = [json.dumps(r) for r in _records(load_table(result_id, start, chunk_size))]
+        yield '\n'.join(lines) + '\n'
@@ -0,0 +1,338 @@
+"""
+Stateful per-dataset execution sessions.
+
+A session is a long-lived kernel process (`app/kernel.py`) that parses a CSV
+into a DataFrame once and then runs snippets against it as `df`. Each snippet
+runs in a child forked from the loaded kernel, so snippets share the parsed
+frame but not each other's state, and up to CONCURRENCY of them run at once.
+Sessions are keyed by dataset fingerprint, so retries and follow-up questions
+on the same file reuse the parsed frame. Idle sessions are closed after
+IDLE_TIMEOUT seconds, and least-recently-used sessions are evicted when the
+kernels' combined memory exceeds MAX_MEMORY_MB.
+
+Snippets are limited in CPU time and additional memory (SNIPPET_MEMORY_MB) but,
+unlike the Docker sandbox, not isolated from the network. Sessions need
+`os.fork` and are therefore POSIX-only.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+
+from app.results import RESULT_FILE, WRITER_SOURCE, output_dir, store_result
+from app.tools import ALLOWED_BUILTINS, MAX_OUTPUT_BYTES, _read_capped, _with_result_error
+
+IDLE_TIMEOUT = float(os.getenv('AGENT_SESSION_IDLE_TIMEOUT', '300'))
+MAX_SESSIONS = int(os.getenv('AGENT_MAX_SESSIONS', '4'))
+MAX_MEMORY_MB = int(os.getenv('AGENT_SESSION_MAX_MEMORY_MB', '2048'))
+LOAD_TIMEOUT = float(os.getenv('AGENT_SESSION_LOAD_TIMEOUT', '60'))
+# Snippets running at once per session; callers beyond that wait, within their timeout
+CONCURRENCY = int(os.getenv('AGENT_SESSION_CONCURRENCY', '4'))
+# Address space a snippet may allocate on top of the kernel's (0 disables the limit)
+SNIPPET_MEMORY_MB = int(os.getenv('AGENT_SESSION_SNIPPET_MEMORY_MB', '1024'))
+# Extra seconds to wait for the kernel to report a killed snippet
+_GRACE = 5.0
+
+_KERNEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kernel.py')
+_IO_DIR = '.io'
+_RUNS_DIR = 'runs'
+
+def fingerprint(csv_path: str) -> str:
+    """Identify a dataset by path, size and modification time."""
+    st = os.stat(csv_path)
+    ident = f"{os.path.abspath(csv_path)}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha1(ident.encode()).hexdigest()
+
+class _Session:
+    """One kernel process holding one parsed dataset."""
+
+    def __init__(self, key: str, csv_path: str):
+        self.key = key
+        self.workdir = tempfile.mkdtemp(prefix='csvagent_session_')
+        self.csv_path = os.path.join(self.workdir, os.path.basename(csv_path))
+        os.makedirs(os.path.join(self.workdir, _IO_DIR))
+        os.makedirs(os.path.join(self.workdir, _RUNS_DIR))
+        shutil.copy(csv_path, self.csv_path)
+        self.slots = threading.BoundedSemaphore(CONCURRENCY)
+        self.last_used = time.monotonic()
+        self.rss_kb = 0
+        self.active = 0
+        self.closing = False
+        self._state = threading.Lock()
+        self._write = threading.Lock()
+        self._pending = {}
+        # Forked snippets must not inherit BLAS thread pools
+        env = dict(os.environ, OPENBLAS_NUM_THREADS='1', OMP_NUM_THREADS='1', MKL_NUM_THREADS='1')
+        self.proc = subprocess.Popen(
+            [sys.executable, _KERNEL],
+            cwd=self.workdir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            env=env,
+        )
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+        reply = self._request({
+            'id': 'init', 'csv_path': self.csv_path, 'builtins': ALLOWED_BUILTINS,
+            'writer': WRITER_SOURCE, 'memory_mb': SNIPPET_MEMORY_MB,
+        }, LOAD_TIMEOUT)
+        if not reply or not reply.get('ok'):
+            self.close()
+            raise RuntimeError((reply or {}).get('error') or 'Session kernel failed to start')
+        self.load_error = reply.get('load_error')
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def _read_replies(self):
+        """Dispatch kernel replies to the waiting requests until the kernel exits."""
+        try:
+            for line in self.proc.stdout:
+                reply = json.loads(line)
+                self.rss_kb = reply.get('rss_kb', self.rss_kb)
+                waiter = self._pending.pop(reply.get('id', 'init'), None)
+                if waiter is not None:
+                    waiter[1] = reply
+                    waiter[0].set()
+        except (OSError, ValueError):
+            pass
+        # Wake everyone still waiting on a dead kernel
+        for event, _ in list(self._pending.values()):
+            event.set()
+
+    def _request(self, msg: dict, timeout: float):
+        """Send one message and wait for its reply; returns None on timeout or if the kernel died."""
+        waiter = [threading.Event(), None]
+        self._pending[msg['id']] = waiter
+        try:
+            with self._write:
+                self.proc.stdin.write(json.dumps(msg) + '\n')
+                self.proc.stdin.flush()
+        except (OSError, ValueError):
+            self._pending.pop(msg['id'], None)
+            return None
+        waiter[0].wait(timeout)
+        self._pending.pop(msg['id'], None)
+        return waiter[1]
+
+    def acquire(self) -> bool:
+        """Register a caller; fails once the session is being closed."""
+        with self._state:
+            if self.closing or not self.alive():
+                return False
+            self.active += 1
+            self.last_used = time.monotonic()
+            return True
+
+    def release(self):
+        with self._state:
+            self.active -= 1
+            self.last_used = time.monotonic()
+
+    def claim(self) -> bool:
+        """Mark an unused session for closing so no new caller picks it up."""
+        with self._state:
+            if self.active:
+                return False
+            self.closing = True
+            return True
+
+    def run(self, code: str, globals_dict: dict, timeout: int, max_output: int) -> dict:
+        """Execute `code` against the session's `df`; same result shape as `run_python`."""
+        started = time.monotonic()
+        # Waiting for a free slot counts against the caller's timeout
+        if not self.slots.acquire(timeout=timeout):
+            return {'timeout': True, 'exit_code': None, 'stdout': '', 'stderr': '',
+                    'stdout_spool': None, 'stderr_spool': None, 'files': [], 'result_id': None}
+        try:
+            return self._run(code, globals_dict, timeout - (time.monotonic() - started), max_output)
+        finally:
+            self.slots.release()
+
+    def _run(self, code: str, globals_dict: dict, timeout: float, max_output: int) -> dict:
+        run_id = uuid.uuid4().hex
+        output_base = output_dir()
+        os.makedirs(output_base, exist_ok=True)
+        run_dir = os.path.join(self.workdir, _RUNS_DIR, run_id)
+        os.makedirs(run_dir)
+        io_dir = os.path.join(self.workdir, _IO_DIR)
+        out_path = os.path.join(io_dir, f'{run_id}.out')
+        err_path = os.path.join(io_dir, f'{run_id}.err')
+        reply = self._request({
+            'id': run_id, 'code': code, 'globals': dict(globals_dict, csv_path=self.csv_path),
+            'cwd': run_dir, 'stdout': out_path, 'stderr': err_path, 'timeout': max(timeout, 0.1),
+        }, timeout + _GRACE)
+        if reply is None:
+            # The kernel died or stopped answering: its state is unknown, so discard it
+            exit_code = self.proc.poll()
+            self.closing = True
+            self.close(keep_workdir=True)
+            result = {'timeout': exit_code is None, 'exit_code': exit_code}
+        else:
+            result = {'timeout': reply.get('timeout', False), 'exit_code': reply.get('exit_code')}
+        for name, path in (('stdout', out_path), ('stderr', err_path)):
+            try:
+                with open(path, 'rb') as f:
+                    text, spool = _read_capped(f, max_output, os.path.join(output_base, f"{run_id}_{name}.txt"))
+                os.remove(path)
+            except OSError:
+                text, spool = '', None
+            result[name] = text
+            result[f'{name}_spool'] = spool
+        # Collect files written by the snippet
+        files = []
+        result_id = None
+        result_error = None
+        for fname in os.listdir(run_dir):
+            src = os.path.join(run_dir, fname)
+            if not os.path.isfile(src):
+                continue
+            if fname == RESULT_FILE:
+                if not result['timeout']:
+                    try:
+                        result_id = store_result(src)
+                    except ValueError as e:
+                        result_error = str(e)
+                continue
+            dst = os.path.join(output_base, f"{run_id}_{fname}")
+            shutil.move(src, dst)
+            files.append(dst)
+        shutil.rmtree(run_dir, ignore_errors=True)
+        result['files'] = files
+        result['result_id'] = result_id
+        if reply is None:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        return _with_result_error(result, result_error)
+
+    def close(self, keep_workdir: bool = False):
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except Exception:
+                pass
+        if not keep_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+_sessions = OrderedDict()
+_lock = threading.Lock()
+_reaper = None
+
+def _close_claimed(sessions):
+    for s in sessions:
+        s.close()
+
+def _reap_idle():
+    now = time.monotonic()
+    with _lock:
+        stale = []
+        for key, s in list(_sessions.items()):
+            if (not s.alive() or now - s.last_used > IDLE_TIMEOUT) and s.claim():
+                stale.append(_sessions.pop(key))
+    _close_claimed(stale)
+
+def _reaper_loop():
+    while True:
+        time.sleep(max(1.0, IDLE_TIMEOUT / 4))
+        _reap_idle()
+
+def _evict(keep: str):
+    """Close least-recently-used sessions until within the session count and memory budget."""
+    with _lock:
+        victims = []
+        count = len(_sessions)
+        total_kb = sum(s.rss_kb for s in _sessions.values())
+        for key in list(_sessions):
+            if count <= MAX_SESSIONS and total_kb <= MAX_MEMORY_MB * 1024:
+                break
+            s = _sessions[key]
+            if key == keep or not s.claim():
+                continue
+            victims.append(_sessions.pop(key))
+            count -= 1
+            total_kb -= s.rss_kb
+    _close_claimed(victims)
+
+def get_session(csv_path: str) -> _Session:
+    """Return the live session for the dataset at `csv_path`, starting one if needed."""
+    global _reaper
+    _reap_idle()
+    key = fingerprint(csv_path)
+    with _lock:
+        session = _sessions.get(key)
+        if session is not None:
+            _sessions.move_to_end(key)
+            return session
+    session = _Session(key, csv_path)
+    with _lock:
+        existing = _sessions.get(key)
+        if existing is not None:
+            # Lost a race with another thread starting the same session
+            duplicate, session = session, existing
+        else:
+            duplicate = None
+            _sessions[key] = session
+        if _reaper is None:
+            _reaper = threading.Thread(target=_reaper_loop, daemon=True)
+            _reaper.start()
+    if duplicate is not None:
+        duplicate.close()
+    _evict(keep=key)
+    return session
+
+def _discard(session):
+    with _lock:
+        if _sessions.get(session.key) is session:
+            del _sessions[session.key]
+
+def run_in_session(code: str, globals_dict: dict, timeout: int = 10, max_output: int = None) -> dict:
+    """
+    Run `code` in the session for `globals_dict['csv_path']`, with the parsed
+    dataset available as `df`. Returns the same dict as `run_python`.
+    Raises RuntimeError if no session kernel can be started.
+    """
+    csv_path = globals_dict['csv_path']
+    for _ in range(2):
+        session = get_session(csv_path)
+        # The session may have been evicted between lookup and use
+        if not session.acquire():
+            _discard(session)
+            continue
+        try:
+            result = session.run(code, globals_dict, timeout, max_output or MAX_OUTPUT_BYTES)
+        finally:
+            session.release()
+        break
+    else:
+        raise RuntimeError('No live session available')
+    if not session.alive():
+        _discard(session)
+    elif session.rss_kb > MAX_MEMORY_MB * 1024 and session.claim():
+        # A single oversized kernel is not kept around
+        _discard(session)
+        session.close()
+    else:
+        _evict(keep=session.key)
+    return result
+
+def close_all():
+    """Stop every session kernel."""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for s in sessions:
+        s.close()
+
+atexit.register(close_all)
@@ -1,26 +1,78 @@
 """Secure code-exec sandbox tools."""
 
 import os
+import re
 import uuid
 import tempfile
 import subprocess
 from textwrap import dedent
+from app.results import RESULT_FILE, WRITER_SOURCE, maybe_cleanup, output_dir, store_result
 
-def run_python(code: str, globals_dict: dict = None, timeout: int = 10):
+# Builtins available to sandboxed code
+ALLOWED_BUILTINS = ['print', 'len', 'sum', 'min', 'max', 'range', 'enumerate', '__import__']
+# Run pandas code for a dataset in its persistent session kernel (see app.sessions; needs os.fork)
+SESSIONS_ENABLED = os.getenv('AGENT_SESSIONS', '1') != '0' and hasattr(os, 'fork')
+
+# Loads the dataset as `df` for standalone scripts, before builtins are restricted
+DF_PREAMBLE = dedent('''
+    try:
+        import pandas as pd
+        df = pd.read_csv(csv_path)
+    except Exception as _e:
+        import sys as _sys
+        print(f"Note: df could not be preloaded from {csv_path}: {_e!r}", file=_sys.stderr)
+''')
+
+# Bytes of stdout/stderr kept in memory; the rest is spooled to a file in the output directory
+MAX_OUTPUT_BYTES = int(os.getenv('AGENT_MAX_OUTPUT_BYTES', str(64 * 1024)))
+
+def _read_capped(f, limit: int, spool_path: str):
+    """
+    Read at most `limit` bytes of a captured stream.
+    If the stream is longer, the full output is written to `spool_path`.
+    Spooled files are deleted after the output retention period (see app.results).
+    Returns (text, spool_path or None).
+    """
+    f.seek(0)
+    head = f.read(limit)
+    rest = f.read(1)
+    if not rest:
+        return head.decode('utf-8', errors='replace'), None
+    import shutil as _sh
+    maybe_cleanup()
+    with open(spool_path, 'wb') as out:
+        out.write(head)
+        out.write(rest)
+        _sh.copyfileobj(f, out)
+    return head.decode('utf-8', errors='replace'), spool_path
+
+def _with_result_error(result: dict, error: str) -> dict:
+    """Report an unreadable `emit_result` table as an execution error so the caller retries."""
+    if error:
+        result['stderr'] = (result.get('stderr') or '') + f"emit_result: {error}\n"
+        result['exit_code'] = result.get('exit_code') or 1
+    return result
+
+def run_python(code: str, globals_dict: dict = None, timeout: int = 10, max_output: int = None):
     """
     Execute Python code in a Docker sandbox with resource limits.
 
     Returns a dict with:
-      - stdout: captured standard output
-      - stderr: captured standard error
+      - stdout: captured standard output (at most `max_output` bytes)
+      - stderr: captured standard error (at most `max_output` bytes)
+      - stdout_spool / stderr_spool: path to the full output if it exceeded the cap, else None
       - exit_code: process return code (None if timed out)
       - timeout: True if execution timed out
+      - files: paths of files the code wrote (e.g. charts)
+      - result_id: id of the stored table passed to `emit_result`, if any (see app.results)
     """
+    if max_output is None:
+        max_output = MAX_OUTPUT_BYTES
     # Unique run identifier for container and outputs
     import uuid as _uuid
     run_id = _uuid.uuid4().hex
     # Prepare output directory on host
-    output_base = os.path.abspath(os.path.join(os.getcwd(), 'agent_outputs'))
+    output_base = output_dir()
     try:
         os.makedirs(output_base, exist_ok=True)
     except Exception:
@@ -44,10 +96,18 @@ def run_python(code: str, globals_dict: dict = None, timeout: int = 10):
                     mod = node.module.split('.')[0]
                     if mod in banned:
                         return {'stdout': '', 'stderr': f"ImportError: module '{mod}' is banned\n", 'exit_code': 1, 'timeout': False}
+    # Pandas code runs outside Docker; for a dataset it runs in the dataset's live session
+    use_local = 'import pandas' in code or 'from pandas' in code
+    if SESSIONS_ENABLED and use_local and globals_dict and os.path.exists(globals_dict.get('csv_path', '')):
+        from app.sessions import run_in_session
+        try:
+            return run_in_session(code, globals_dict, timeout=timeout, max_output=max_output)
+        except RuntimeError:
+            # No kernel could be started; run the snippet as a standalone script instead
+            pass
     # Prepare restricted builtins
-    allowed = ['print', 'len', 'sum', 'min', 'max', 'range', 'enumerate', '__import__']
-    builtins_map = ', '.join(f"'{name}': {name}" for name in allowed)
-    header = dedent(f"""
+    builtins_map = ', '.join(f"'{name}': {name}" for name in ALLOWED_BUILTINS)
+    restrict = dedent(f"""
         # restrict builtins
         __builtins__ = {{{builtins_map}}}
     """)
@@ -66,8 +126,9 @@ def run_python(code: str, globals_dict: dict = None, timeout: int = 10):
     if globals_dict:
         for k, v in globals_dict.items():
             globals_code += f"{k} = {repr(v)}\n"
-    # Combine script
-    script = header + '\n' + globals_code + '\n' + code
+    # Combine script; `df` is preloaded like in a session when the code uses it
+    preamble = DF_PREAMBLE if csv_name and re.search(r'\bdf\b', code) else ''
+    script = WRITER_SOURCE + '\n' + globals_code + preamble + restrict + '\n' + code
     # Ensure Docker image is available locally (pull if needed)
     image = 'python:3.12-slim'
     try:
@@ -80,7 +141,8 @@ def run_python(code: str, globals_dict: dict = None, timeout: int = 10):
     except Exception:
         pass
     # Create temp workspace
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with tempfile.TemporaryDirectory() as tmpdir, \
+            tempfile.TemporaryFile() as out_f, tempfile.TemporaryFile() as err_f:
         # Copy CSV file into sandbox if needed
         if csv_to_copy:
             try:
@@ -91,28 +153,25 @@ def run_python(code: str, globals_dict: dict = None, timeout: int = 10):
         script_path = os.path.join(tmpdir, 'script.py')
         with open(script_path, 'w') as f:
             f.write(script)
+        # Output goes to disk, not pipes, so a chatty script cannot exhaust host memory
+        def capture():
+            stdout, stdout_spool = _read_capped(out_f, max_output, os.path.join(output_base, f"{run_id}_stdout.txt"))
+            stderr, stderr_spool = _read_capped(err_f, max_output, os.path.join(output_base, f"{run_id}_stderr.txt"))
+            return {'stdout': stdout, 'stderr': stderr, 'stdout_spool': stdout_spool, 'stderr_spool': stderr_spool}
         # Decide execution method: if pandas code, run locally in venv; else Docker sandbox
         import sys
-        use_local = 'import pandas' in code or 'from pandas' in code
         if use_local:
             # Run script with local Python (assumes venv has pandas installed)
             try:
                 proc = subprocess.run(
                     [sys.executable, script_path],
                     cwd=tmpdir,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
+                    stdout=out_f,
+                    stderr=err_f,
                     timeout=timeout,
-                    text=True
                 )
-            except subprocess.TimeoutExpired as e:
-                return {
-                    'stdout': e.stdout or '',
-                    'stderr': e.stderr or '',
-                    'exit_code': None,
-                    'timeout': True,
-                    'files': []
-                }
+            except subprocess.TimeoutExpired:
+                return dict(capture(), exit_code=None, timeout=True, files=[], result_id=None)
         else:
             # Docker run command
             cname = f"csvagent_{run_id}"
@@ -125,18 +184,17 @@ def run_python(code: str, globals_dict: dict = None, timeout: int = 10):
             try:
                 proc = subprocess.run(
                     cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
+                    stdout=out_f,
+                    stderr=err_f,
                     timeout=timeout,
-                    text=True
                 )
-            except subprocess.TimeoutExpired as e:
+            except subprocess.TimeoutExpired:
                 subprocess.run(['docker', 'kill', cname], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
                 # Collect files and return on timeout
                 files = []
                 try:
                     for fname in os.listdir(tmpdir):
-                        if fname in ('script.py', os.path.basename(csv_to_copy) if csv_to_copy else ''):
+                        if fname in ('script.py', RESULT_FILE, os.path.basename(csv_to_copy) if csv_to_copy else ''):
                             continue
                         src = os.path.join(tmpdir, fname)
                         if os.path.isfile(src):
@@ -146,22 +204,35 @@ def run_python(code: str, globals_dict: dict = None, timeout: int = 10):
                             files.append(dst)
                 except Exception:
                     files = []
-                return {'stdout': e.stdout or '', 'stderr': e.stderr or '', 'exit_code': None, 'timeout': True, 'files': files}
+                return dict(capture(), exit_code=None, timeout=True, files=files, result_id=None)
         # Execution completed
         files = []
+        result_id = None
+        result_error = None
         try:
             for fname in os.listdir(tmpdir):
                 if fname == 'script.py' or fname == csv_name:
                     continue
                 src = os.path.join(tmpdir, fname)
-                if os.path.isfile(src):
-                    dst = os.path.join(output_base, f"{run_id}_{fname}")
-                    import shutil as _sh
-                    _sh.copy(src, dst)
-                    files.append(dst)
+                if not os.path.isfile(src):
+                    continue
+                # Structured results travel through the side channel, not as output files
+                if fname == RESULT_FILE:
+                    try:
+                        result_id = store_result(src)
+                    except ValueError as e:
+                        result_error = str(e)
+                    continue
+                dst = os.path.join(output_base, f"{run_id}_{fname}")
+                import shutil as _sh
+                _sh.copy(src, dst)
+                files.append(dst)
         except Exception:
             files = []
-        return {'stdout': proc.stdout, 'stderr': proc.stderr, 'exit_code': proc.returncode, 'timeout': False, 'files': files}
+        return _with_result_error(
+            dict(capture(), exit_code=proc.returncode, timeout=False, files=files, result_id=result_id),
+            result_error,
+        )
     # end of run_python
 
 def plot_chart(code: str, csv_path: str) -> list[str]:
@@ -171,6 +242,7 @@ def plot_chart(code: str, csv_path: str) -> list[str]:
 
     The code string may assume variables:
       - csv_path: path to CSV file (copied into workspace)
+      - df: the CSV loaded as a DataFrame (if the code uses `df` and pandas can parse the file)
       - pd: pandas module
       - plt: matplotlib.pyplot module
     """
@@ -193,10 +265,30 @@ def plot_chart(code: str, csv_path: str) -> list[str]:
     # Setup execution environment
     workspace_csv = os.path.join(tmpdir, os.path.basename(csv_path))
     env = {'pd': pd, 'plt': plt, 'csv_path': workspace_csv}
+    load_error = None
+    if os.path.exists(csv_path) and re.search(r'\bdf\b', code):
+        from app.compiler import load_dataframe
+        try:
+            df = load_dataframe(csv_path)
+        except Exception as e:
+            # The code may still read the file itself (e.g. with other parser options)
+            load_error = e
+        else:
+            # With Copy-on-Write a shallow copy already keeps the cached frame unmodified
+            cow = int(pd.__version__.split('.')[0]) >= 3 or pd.get_option('mode.copy_on_write') is True
+            env['df'] = df.copy(deep=not cow)
     # Execute code
-    exec(code, env)
-    # Save figure
+    try:
+        exec(code, env)
+    except Exception as e:
+        if load_error is not None:
+            raise RuntimeError(f"{type(e).__name__}: {e}\nNote: df could not be preloaded from "
+                               f"{os.path.basename(csv_path)}: {load_error!r}") from e
+        raise
+    # Save figure, downsampling large series so render time and file size stay bounded
+    from app.charts import downsample_figure
     fig = plt.gcf()
+    downsample_figure(fig)
     out_file = os.path.join(tmpdir, 'chart.png')
     fig.savefig(out_file)
     plt.close(fig)
@@ -0,0 +1,109 @@
+"""Worker entry point: lease jobs from the queue and run the agent on them."""
+import os
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CSV Data-Analyst Agent worker")
+    parser.add_argument("--processes", type=int, default=1, help="Number of worker processes to start")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+    parser.add_argument("--visibility-timeout", type=int, default=None, help="Seconds a leased job stays invisible to other workers")
+    parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+    return parser.parse_args()
+
+def report_stats(worker_id: str):
+    """Publish this process's LLM gateway metrics to the job database."""
+    from app import jobs, llm
+    try:
+        jobs.record_worker_stats(worker_id, llm.stats())
+    except Exception as e:
+        print(f"[Worker {worker_id}] Could not record stats: {e}")
+
+def _heartbeat(job_id: str, worker_id: str, visibility_timeout: int, stop: threading.Event):
+    """Keep extending the lease on a running job until `stop` is set."""
+    from app import jobs
+    while not stop.wait(max(1.0, visibility_timeout / 3)):
+        report_stats(worker_id)
+        if not jobs.extend(job_id, worker_id, visibility_timeout):
+            print(f"[Worker {worker_id}] Lost lease on job {job_id}")
+            return
+
+def process_one(worker_id: str, visibility_timeout: int = None) -> bool:
+    """
+    Lease and run a single job. Returns False if no job was available.
+    """
+    from app import jobs
+    from app.agent import main as agent_main, is_failure, is_transient_failure
+
+    if visibility_timeout is None:
+        visibility_timeout = jobs.DEFAULT_VISIBILITY_TIMEOUT
+    job = jobs.lease(worker_id, visibility_timeout)
+    if job is None:
+        return False
+    print(f"[Worker {worker_id}] Job {job['id']} attempt {job['attempts']}/{job['max_attempts']}")
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat, args=(job['id'], worker_id, visibility_timeout, stop), daemon=True
+    )
+    heartbeat.start()
+    try:
+        result = agent_main(job['question'], job['csv_path'])
+    except ValueError as e:
+        # Bad input (e.g. missing CSV) will not succeed on retry
+        print(f"[Worker {worker_id}] Job {job['id']} rejected: {e}")
+        jobs.fail(job['id'], worker_id, str(e), retry=False)
+    except Exception as e:
+        print(f"[Worker {worker_id}] Job {job['id']} failed: {e}")
+        jobs.fail(job['id'], worker_id, str(e))
+    else:
+        if is_failure(result):
+            # The agent reports failures as messages; only LLM API errors are worth another attempt
+            print(f"[Worker {worker_id}] Job {job['id']} failed: {result.splitlines()[0]}")
+            jobs.fail(job['id'], worker_id, result, retry=is_transient_failure(result), result=result)
+        elif not jobs.complete(job['id'], worker_id, result):
+            print(f"[Worker {worker_id}] Lease on job {job['id']} expired before completion")
+    finally:
+        stop.set()
+        heartbeat.join()
+    return True
+
+def work(poll_interval: float = 1.0, visibility_timeout: int = None, once: bool = False):
+    """Run the lease/execute loop until interrupted (or the queue drains if `once`)."""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"[Worker {worker_id}] Started")
+    try:
+        while True:
+            busy = process_one(worker_id, visibility_timeout)
+            report_stats(worker_id)
+            if not busy:
+                if once:
+                    return
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    args = parse_args()
+    kwargs = {
+        'poll_interval': args.poll_interval,
+        'visibility_timeout': args.visibility_timeout,
+        'once': args.once,
+    }
+    if args.processes <= 1:
+        work(**kwargs)
+        return
+    procs = [multiprocessing.Process(target=work, kwargs=kwargs) for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""Shared fixtures: a temporary job queue database and an in-process worker."""
+import sys, os, importlib, threading
+
+# Ensure app package importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+@pytest.fixture
+def jobs_db(tmp_path, monkeypatch):
+    """Point `app.jobs` at a temporary database, restoring the default afterwards."""
+    import app.jobs as jobs_mod
+    monkeypatch.setenv('AGENT_QUEUE_DB', str(tmp_path / 'jobs.db'))
+    importlib.reload(jobs_mod)
+    yield jobs_mod
+    jobs_mod._conn.close()
+    monkeypatch.undo()
+    importlib.reload(jobs_mod)
+
+@pytest.fixture
+def worker(jobs_db):
+    """Run queued jobs in a background thread, as `python -m app.worker` would."""
+    import time
+    from app.worker import process_one
+    stop = threading.Event()
+    def loop():
+        while not stop.is_set():
+            if not process_one('test-worker'):
+                time.sleep(0.02)
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    yield
+    stop.set()
+    thread.join()
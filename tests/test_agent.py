@@ -73,4 +73,39 @@ def test_file_output(monkeypatch):
     result = agent_main("generate chart", "examples/iris.csv")
     assert isinstance(result, dict)
     assert 'files' in result
-    assert result['files'] == ['agent_outputs/123_chart.png', 'agent_outputs/123_plot.jpg']
\ No newline at end of file
+    assert result['files'] == ['agent_outputs/123_chart.png', 'agent_outputs/123_plot.jpg']
+
+def test_unreadable_result_retried(monkeypatch, tmp_path):
+    monkeypatch.setenv('AGENT_OUTPUT_DIR', str(tmp_path))
+    def fake_chatcompletion_create(*args, **kwargs):
+        return DummyResponse("print(42)")
+    monkeypatch.setattr(openai.ChatCompletion, 'create', fake_chatcompletion_create)
+    calls = []
+    # First run reports a stored table that cannot be read, the retry prints the answer
+    def fake_run_python(code, globals_dict=None, timeout=None):
+        calls.append(code)
+        if len(calls) == 1:
+            return {'stdout': '', 'stderr': '', 'exit_code': 0, 'timeout': False, 'files': [], 'result_id': '0' * 32}
+        return {'stdout': '42\n', 'stderr': '', 'exit_code': 0, 'timeout': False, 'files': []}
+    import app.agent as agent_mod
+    monkeypatch.setattr(agent_mod, 'run_python', fake_run_python)
+    monkeypatch.setattr(agent_mod, 'get_cache', lambda key: None)
+    monkeypatch.setattr(agent_mod, 'set_cache', lambda key, value: None)
+    assert agent_main("answer from an unreadable table", "examples/iris.csv") == 42
+    assert len(calls) == 2
+
+def test_chart_error_retried(monkeypatch):
+    def fake_chatcompletion_create(*args, **kwargs):
+        return DummyResponse("plt.plot(df['x'])")
+    monkeypatch.setattr(openai.ChatCompletion, 'create', fake_chatcompletion_create)
+    calls = []
+    def fake_plot_chart(code, csv_path):
+        calls.append(code)
+        if len(calls) == 1:
+            raise KeyError('x')
+        return ['agent_outputs/chart.png']
+    import app.tools as tools_mod
+    monkeypatch.setattr(tools_mod, 'plot_chart', fake_plot_chart)
+    result = agent_main("plot x", "examples/iris.csv")
+    assert result == {'files': ['agent_outputs/chart.png']}
+    assert len(calls) == 2
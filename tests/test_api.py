@@ -8,7 +8,7 @@ from app.api import app
 
 client = TestClient(app)
 
-def test_ask_row_count(tmp_path):
+def test_ask_row_count(tmp_path, worker):
     src = "examples/iris.csv"
     dest = tmp_path / "iris.csv"
     shutil.copy(src, dest)
@@ -16,7 +16,7 @@ def test_ask_row_count(tmp_path):
     assert response.status_code == 200
     assert response.json() == {"result": 3}
 
-def test_ask_column_names(tmp_path):
+def test_ask_column_names(tmp_path, worker):
     src = "examples/iris.csv"
     dest = tmp_path / "iris.csv"
     shutil.copy(src, dest)
@@ -25,14 +25,80 @@ def test_ask_column_names(tmp_path):
     assert response.status_code == 200
     assert response.json() == {"result": expected}
 
-def test_ask_bad_csv(tmp_path):
+def test_ask_bad_csv(tmp_path, worker):
     bad = tmp_path / "no.csv"
     response = client.post("/ask", json={"question": "row count", "csv_path": str(bad)})
     assert response.status_code == 400
 
-def test_unsupported_question(tmp_path):
+def test_unsupported_question(tmp_path, worker):
     src = "examples/iris.csv"
     dest = tmp_path / "iris.csv"
     shutil.copy(src, dest)
     response = client.post("/ask", json={"question": "foo", "csv_path": str(dest)})
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+def test_job_submit_and_poll(tmp_path, jobs_db):
+    src = "examples/iris.csv"
+    dest = tmp_path / "iris.csv"
+    shutil.copy(src, dest)
+    response = client.post("/jobs", json={"question": "row count", "csv_path": str(dest)})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    response = client.get(f"/jobs/{job_id}")
+    assert response.status_code == 200
+    assert response.json()["status"] == "queued"
+    # Result is not available until a worker finishes the job
+    assert client.get(f"/jobs/{job_id}/result").status_code == 409
+    from app.worker import process_one
+    while process_one("test-worker"):
+        pass
+    response = client.get(f"/jobs/{job_id}/result")
+    assert response.status_code == 200
+    assert response.json() == {"result": 3}
+
+def test_job_unknown(jobs_db):
+    assert client.get("/jobs/missing").status_code == 404
+
+def test_identical_questions_share_one_job(tmp_path, jobs_db, monkeypatch):
+    import time, threading, types, openai
+    import app.agent as agent_mod
+    from app import sessions
+    from app.worker import process_one
+    dest = tmp_path / "iris.csv"
+    shutil.copy("examples/iris.csv", dest)
+    calls = []
+    def fake_create(*args, **kwargs):
+        calls.append(kwargs['messages'][-1]['content'])
+        time.sleep(0.3)
+        message = types.SimpleNamespace(content="import pandas as pd\nprint(len(df))")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+    monkeypatch.setattr(openai.ChatCompletion, 'create', fake_create)
+    monkeypatch.setattr(agent_mod, 'get_cache', lambda key: None)
+    monkeypatch.setattr(agent_mod, 'set_cache', lambda key, value: None)
+    # Several workers, as separate processes would run them
+    stop = threading.Event()
+    def work(worker_id):
+        while not stop.is_set():
+            if not process_one(worker_id):
+                time.sleep(0.02)
+    workers = [threading.Thread(target=work, args=(f"w{i}",), daemon=True) for i in range(3)]
+    for t in workers:
+        t.start()
+    responses = []
+    def ask():
+        responses.append(client.post("/ask", json={"question": "how spread out are petals", "csv_path": str(dest)}))
+    askers = [threading.Thread(target=ask) for _ in range(6)]
+    try:
+        for t in askers:
+            t.start()
+        for t in askers:
+            t.join()
+    finally:
+        stop.set()
+        for t in workers:
+            t.join()
+        sessions.close_all()
+    assert [r.json() for r in responses] == [{"result": 3}] * 6
+    assert jobs_db._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 1
+    # One code generation and one reflection for all six callers
+    assert len(calls) == 2
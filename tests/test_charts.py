@@ -0,0 +1,76 @@
+"""Tests for server-side chart downsampling."""
+import sys, os
+import matplotlib
+matplotlib.use('Agg')  # Use non-interactive backend for tests
+
+# Ensure app package importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import PathCollection, PolyCollection
+from app.charts import lttb, downsample_figure
+from app.tools import plot_chart
+
+def test_lttb_keeps_endpoints_and_peaks():
+    x = np.arange(100_000, dtype=float)
+    y = np.zeros_like(x)
+    y[54_321] = 10.0
+    dx, dy = lttb(x, y, 500)
+    assert len(dx) == 500
+    assert dx[0] == 0 and dx[-1] == x[-1]
+    assert dy.max() == 10.0
+    assert np.all(np.diff(dx) > 0)
+
+def test_lttb_short_series_unchanged():
+    dx, dy = lttb([1, 2, 3], [4, 5, 6], 10)
+    assert dx.tolist() == [1, 2, 3]
+    assert dy.tolist() == [4, 5, 6]
+
+def test_downsample_figure():
+    fig, (ax1, ax2, ax3, ax4) = plt.subplots(1, 4)
+    rng = np.random.default_rng(0)
+    ax1.plot(np.cumsum(rng.normal(size=50_000)))
+    ax2.scatter(rng.normal(size=50_000), rng.normal(size=50_000))
+    ax3.plot([1, 2, 3])
+    ax4.plot(rng.normal(size=50_000), rng.normal(size=50_000), 'o')
+    assert downsample_figure(fig, max_points=1000) == 3
+    assert len(ax1.get_lines()[0].get_xdata()) == 1000
+    assert not any(isinstance(c, PathCollection) for c in ax2.collections)
+    assert any(isinstance(c, PolyCollection) for c in ax2.collections)
+    assert len(ax3.get_lines()[0].get_xdata()) == 3
+    assert not ax4.get_lines()
+    assert any(isinstance(c, PolyCollection) for c in ax4.collections)
+    plt.close(fig)
+
+def test_plot_chart_size_bounded(tmp_path):
+    # One series under MAX_POINTS, drawn as is, and one far above it, which is downsampled
+    sizes = []
+    for n in (1_500, 200_000):
+        csv = tmp_path / f'series_{n}.csv'
+        rng = np.random.default_rng(1)
+        np.savetxt(csv, np.column_stack([np.arange(n), rng.normal(size=n).cumsum()]),
+                   delimiter=',', header='t,v', comments='')
+        # `df` is preloaded from csv_path
+        code = "plt.plot(df['t'], df['v'])"
+        files = plot_chart(code, str(csv))
+        sizes.append(os.path.getsize(files[0]))
+    assert sizes[1] < sizes[0] * 2
+
+def test_plot_chart_unparsable_csv(tmp_path):
+    csv = tmp_path / 'ragged.csv'
+    csv.write_text('a,b\n1,2\n3,4,5\n6,7\n')
+    # Code that reads the file itself is not blocked by the failing preload
+    code = "data = pd.read_csv(csv_path, on_bad_lines='skip')\nplt.plot(data['a'], data['b'])"
+    assert os.path.exists(plot_chart(code, str(csv))[0])
+    # Code relying on df gets the reason it is missing
+    with pytest.raises(RuntimeError, match='could not be preloaded'):
+        plot_chart("plt.plot(df['a'])", str(csv))
+
+def test_plot_chart_leaves_cached_frame_unchanged(tmp_path):
+    from app.compiler import load_dataframe
+    csv = tmp_path / 'series.csv'
+    csv.write_text('t,v\n1,2\n3,4\n')
+    plot_chart("df.loc[0, 'v'] = 100\nplt.plot(df['t'], df['v'])", str(csv))
+    assert load_dataframe(str(csv))['v'].tolist() == [2, 4]
@@ -0,0 +1,87 @@
+"""Tests for the rule-based NL-to-pandas query compiler."""
+import sys, os
+
+# Ensure app package importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from app.compiler import answer_question, compile_question, load_dataframe
+
+COMPLEX = "examples/complex.csv"
+
+def test_average_by_group():
+    df = load_dataframe(COMPLEX)
+    expected = df.groupby('cat1')['num5'].mean()
+    result = answer_question("What is the average num5 per cat1?", COMPLEX)
+    assert list(result.columns) == ['cat1', 'num5']
+    assert result['num5'].tolist() == expected.tolist()
+
+def test_top_n_by_count():
+    df = load_dataframe(COMPLEX)
+    expected = df['cat3'].value_counts().head(2)
+    result = answer_question("top 2 cat3 by count", COMPLEX)
+    assert result['count'].tolist() == expected.tolist()
+
+def test_sum_where():
+    df = load_dataframe(COMPLEX)
+    expected = df[df['cat1'] == 'A']['num1'].sum()
+    assert answer_question("sum of num1 where cat1 = 'A'", COMPLEX) == expected
+    assert answer_question("how many rows where cat1 = 'A' and num1 > 1", COMPLEX) == int(
+        ((df['cat1'] == 'A') & (df['num1'] > 1)).sum()
+    )
+
+def test_no_matching_rows():
+    assert answer_question("how many rows where num1 > 1000000", COMPLEX) == 0
+    with pytest.raises(ValueError):
+        answer_question("average num1 where num1 > 1000000", COMPLEX)
+
+def test_large_group_result_paginated(tmp_path, monkeypatch):
+    from app.agent import format_result
+    from app.results import INLINE_ROWS
+    monkeypatch.setenv('AGENT_OUTPUT_DIR', str(tmp_path))
+    csv_file = tmp_path / 'ids.csv'
+    csv_file.write_text('id,value\n' + ''.join(f'{i},{i % 7}\n' for i in range(200)))
+    result = answer_question("count by id", str(csv_file))
+    assert len(result) > INLINE_ROWS
+    table = format_result(result)['table']
+    assert table['rows'] == len(result)
+    assert len(table['preview']) == INLINE_ROWS
+
+def test_plan_shape():
+    plan = compile_question("top 3 cat2 by average num4 where bool1 = true", ['num4', 'cat2', 'bool1'])
+    assert plan == {
+        'filters': [('bool1', '==', 'true')], 'groupby': 'cat2', 'agg': 'mean',
+        'column': 'num4', 'sort': 'desc', 'limit': 3,
+    }
+
+def test_dataframe_cached():
+    assert load_dataframe(COMPLEX) is load_dataframe(COMPLEX)
+
+def test_dataframe_cache_memory_bound(tmp_path, monkeypatch):
+    from app import compiler
+    monkeypatch.setattr(compiler, '_df_cache', compiler.OrderedDict())
+    monkeypatch.setattr(compiler, 'CACHE_MEMORY_MB', 1)
+    def write(name, rows):
+        path = tmp_path / name
+        path.write_text('a\n' + ''.join(f'x{i:0100d}\n' for i in range(rows)))
+        return str(path)
+    first, second, big = write('first.csv', 4000), write('second.csv', 4000), write('big.csv', 30000)
+    df = load_dataframe(first)
+    assert 0.5 * 1024 * 1024 < df.memory_usage(deep=True).sum() < 1024 * 1024
+    assert load_dataframe(first) is df
+    # Both frames do not fit the budget: the least recently used one is evicted
+    load_dataframe(second)
+    assert load_dataframe(first) is not df
+    assert compiler._cache_bytes() <= 1024 * 1024
+    # Larger than the whole budget: parsed every time, never cached
+    assert load_dataframe(big) is not load_dataframe(big)
+
+@pytest.mark.parametrize("question", [
+    "average of unknown_col by cat1",
+    "why did sales drop in Q4?",
+    "sum of cat1",
+    "row count",
+])
+def test_unsupported(question):
+    with pytest.raises(ValueError):
+        answer_question(question, COMPLEX)
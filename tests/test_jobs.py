@@ -0,0 +1,104 @@
+"""Tests for the SQLite job queue and worker loop."""
+import sys
+import os
+
+# Ensure app package is importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+@pytest.fixture
+def jobs_mod(jobs_db):
+    return jobs_db
+
+def test_enqueue_lease_complete(jobs_mod):
+    job_id = jobs_mod.enqueue('row count', 'examples/iris.csv')
+    assert jobs_mod.get_job(job_id)['status'] == 'queued'
+    job = jobs_mod.lease('w1')
+    assert job['id'] == job_id
+    assert job['attempts'] == 1
+    # Leased job is invisible to other workers
+    assert jobs_mod.lease('w2') is None
+    assert jobs_mod.complete(job_id, 'w1', {'files': ['a.png']})
+    job = jobs_mod.get_job(job_id)
+    assert job['status'] == 'done'
+    assert job['result'] == {'files': ['a.png']}
+
+def test_visibility_timeout_and_retries(jobs_mod):
+    job_id = jobs_mod.enqueue('q', 'examples/iris.csv', max_attempts=2)
+    assert jobs_mod.lease('w1', visibility_timeout=-1)['id'] == job_id
+    # Lease expired: another worker picks it up and the stale worker loses it
+    assert jobs_mod.lease('w2', visibility_timeout=-1)['attempts'] == 2
+    assert not jobs_mod.complete(job_id, 'w1', 1)
+    # Attempts exhausted after the second lease expires
+    assert jobs_mod.lease('w3') is None
+    job = jobs_mod.get_job(job_id)
+    assert job['status'] == 'failed'
+
+def test_fail_requeues_until_exhausted(jobs_mod):
+    job_id = jobs_mod.enqueue('q', 'examples/iris.csv', max_attempts=2)
+    jobs_mod.lease('w1')
+    jobs_mod.fail(job_id, 'w1', 'boom')
+    assert jobs_mod.get_job(job_id)['status'] == 'queued'
+    jobs_mod.lease('w1')
+    jobs_mod.fail(job_id, 'w1', 'boom')
+    job = jobs_mod.get_job(job_id)
+    assert job['status'] == 'failed'
+    assert job['error'] == 'boom'
+
+def test_worker_processes_job(jobs_mod, monkeypatch):
+    import app.agent as agent_mod
+    from app.worker import process_one
+    monkeypatch.setattr(agent_mod, 'main', lambda question, csv_path: 42)
+    job_id = jobs_mod.enqueue('what is 6*7', 'examples/iris.csv')
+    assert process_one('w1')
+    assert not process_one('w1')
+    assert jobs_mod.get_job(job_id)['result'] == 42
+
+def test_agent_failure_message_retried(jobs_mod, monkeypatch):
+    import app.agent as agent_mod
+    from app.worker import process_one
+    monkeypatch.setattr(agent_mod, 'main', lambda question, csv_path: 'OpenAI API error: boom')
+    job_id = jobs_mod.enqueue('q', 'examples/iris.csv', max_attempts=2)
+    process_one('w1')
+    assert jobs_mod.get_job(job_id)['status'] == 'queued'
+    process_one('w1')
+    job = jobs_mod.get_job(job_id)
+    assert job['status'] == 'failed'
+    assert job['result'] == 'OpenAI API error: boom'
+
+def test_exhausted_code_generation_not_retried(jobs_mod, monkeypatch):
+    import app.agent as agent_mod
+    from app.worker import process_one
+    failure = 'Failed to generate working code after 8 attempts. Last error:\nboom'
+    monkeypatch.setattr(agent_mod, 'main', lambda question, csv_path: failure)
+    job_id = jobs_mod.enqueue('q', 'examples/iris.csv', max_attempts=3)
+    process_one('w1')
+    job = jobs_mod.get_job(job_id)
+    assert job['status'] == 'failed'
+    assert job['attempts'] == 1
+    assert job['result'] == failure
+
+def test_bad_input_not_retried(jobs_mod, monkeypatch):
+    from app.worker import process_one
+    job_id = jobs_mod.enqueue('q', 'missing.csv', max_attempts=3)
+    process_one('w1')
+    job = jobs_mod.get_job(job_id)
+    assert job['status'] == 'failed'
+    assert job['attempts'] == 1
+
+def test_heartbeat_extends_lease(jobs_mod, monkeypatch):
+    import time
+    import app.agent as agent_mod
+    from app.worker import process_one
+    def slow_agent(question, csv_path):
+        time.sleep(2.5)
+        # Lease would have expired after 1.5s without the heartbeat
+        assert jobs_mod.lease('w2', visibility_timeout=10) is None
+        return 1
+    monkeypatch.setattr(agent_mod, 'main', slow_agent)
+    job_id = jobs_mod.enqueue('q', 'examples/iris.csv')
+    process_one('w1', visibility_timeout=1.5)
+    job = jobs_mod.get_job(job_id)
+    assert job['status'] == 'done'
+    assert job['attempts'] == 1
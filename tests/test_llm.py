@@ -0,0 +1,93 @@
+"""Tests for the LLM gateway: single-flight, priority rate limiting and backoff."""
+import sys, os, types, threading, time
+
+# Ensure app package importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import openai
+import pytest
+from app import llm
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+class RateLimitError(Exception):
+    http_status = 429
+
+def test_single_flight_coalesces(monkeypatch):
+    calls = []
+    release = threading.Event()
+    def fake_create(**kwargs):
+        calls.append(kwargs)
+        release.wait(2)
+        return types.SimpleNamespace(id='resp')
+    monkeypatch.setattr(openai.ChatCompletion, 'create', fake_create)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(llm.chat(MESSAGES, model='m', max_tokens=8)))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    # Wait for all followers to attach to the leader's call
+    deadline = time.time() + 2
+    while llm.stats()['coalesced'] < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert all(r is results[0] for r in results)
+
+def test_retry_on_rate_limit(monkeypatch):
+    attempts = []
+    def fake_create(**kwargs):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RateLimitError('slow down')
+        return 'ok'
+    monkeypatch.setattr(openai.ChatCompletion, 'create', fake_create)
+    monkeypatch.setattr(llm.time, 'sleep', lambda s: None)
+    assert llm.chat(MESSAGES, model='m', max_tokens=16) == 'ok'
+    assert len(attempts) == 3
+
+def test_non_retryable_error_propagates(monkeypatch):
+    def fake_create(**kwargs):
+        raise ValueError('bad request')
+    monkeypatch.setattr(openai.ChatCompletion, 'create', fake_create)
+    with pytest.raises(ValueError):
+        llm.chat(MESSAGES, model='m', max_tokens=32)
+
+def test_priority_order():
+    bucket = llm._TokenBucket(rate=20, burst=1)
+    bucket.acquire(llm.PRIORITY_CODE)  # drain the bucket
+    order = []
+    def worker(priority, name):
+        bucket.acquire(priority)
+        order.append(name)
+    low = threading.Thread(target=worker, args=(llm.PRIORITY_REFLECTION, 'reflection'))
+    low.start()
+    time.sleep(0.01)
+    high = threading.Thread(target=worker, args=(llm.PRIORITY_CODE, 'code'))
+    high.start()
+    low.join()
+    high.join()
+    assert order == ['code', 'reflection']
+
+def test_worker_stats_merged(jobs_db):
+    from fastapi.testclient import TestClient
+    from app.api import app
+    jobs_db.record_worker_stats('h1:1', {'queue_depth': 2, 'inflight': 1, 'coalesced': 3,
+                                         'admitted': 10, 'avg_wait': 0.5, 'max_wait': 2.0})
+    jobs_db.record_worker_stats('h2:7', {'queue_depth': 1, 'inflight': 0, 'coalesced': 0,
+                                         'admitted': 30, 'avg_wait': 0.1, 'max_wait': 0.4})
+    response = TestClient(app).get('/stats/llm')
+    assert response.status_code == 200
+    body = response.json()
+    assert [w['worker'] for w in body['workers']] == ['h1:1', 'h2:7']
+    total = body['total']
+    assert total['workers'] == 2
+    assert total['queue_depth'] == 3
+    assert total['admitted'] == 40
+    assert total['max_wait'] == 2.0
+    assert total['avg_wait'] == pytest.approx((0.5 * 10 + 0.1 * 30) / 40)
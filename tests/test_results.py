@@ -0,0 +1,116 @@
+"""Tests for bounded output capture, the result side channel and result pagination."""
+import sys, os
+
+# Ensure app package importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi.testclient import TestClient
+from app.api import app
+from app.tools import run_python
+from app import results
+
+IRIS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'examples', 'iris.csv'))
+
+client = TestClient(app)
+
+def test_output_capped_and_spooled(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    code = "import pandas as pd\nprint('x' * 5000)"
+    result = run_python(code, max_output=1000)
+    assert result['exit_code'] == 0
+    assert len(result['stdout']) == 1000
+    spool = result['stdout_spool']
+    assert spool and os.path.getsize(spool) == 5001
+    assert result['files'] == []
+
+def test_emit_result_side_channel(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    code = (
+        "import pandas as pd\n"
+        "df = pd.read_csv(csv_path)\n"
+        "emit_result(df.groupby('species')['sepal_length'].mean())"
+    )
+    result = run_python(code, globals_dict={'csv_path': IRIS})
+    assert result['exit_code'] == 0, result['stderr']
+    assert result['stdout'] == ''
+    assert result['files'] == []
+    df = results.load_table(result['result_id'])
+    assert list(df.columns) == ['species', 'sepal_length']
+    assert df['species'].tolist() == ['setosa']
+
+def test_emit_result_object_columns(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    code = (
+        "import pandas as pd\n"
+        "emit_result(pd.DataFrame({\n"
+        "    'ts': pd.date_range('2024-01-01', periods=3, tz='UTC'),\n"
+        "    'n': pd.array([1, None, 3], dtype='Int64'),\n"
+        "    'flag': pd.array([True, None, False], dtype='boolean'),\n"
+        "}))"
+    )
+    result = run_python(code)
+    assert result['exit_code'] == 0, result['stderr']
+    df = results.load_table(result['result_id'])
+    assert df['ts'].tolist()[0].startswith('2024-01-01')
+    assert df['n'].tolist()[0] == 1 and df['n'].isna().tolist() == [False, True, False]
+    assert df['flag'].tolist()[::2] == ['True', 'False']
+
+def test_unreadable_result_is_an_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    code = "import pandas as pd\nopen('_result.npz', 'w').write('garbage')"
+    result = run_python(code)
+    assert result['exit_code'] == 1
+    assert result['result_id'] is None
+    assert 'emit_result' in result['stderr']
+
+def test_result_pagination(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    code = "import pandas as pd\nemit_result(pd.DataFrame({'n': list(range(250)), 's': ['a'] * 250}))"
+    result = run_python(code)
+    result_id = result['result_id']
+    response = client.get(f"/results/{result_id}", params={"offset": 240, "limit": 20})
+    assert response.status_code == 200
+    page = response.json()
+    assert page['total'] == 250
+    assert [r['n'] for r in page['rows']] == list(range(240, 250))
+    response = client.get(f"/results/{result_id}/stream", params={"chunk_size": 100})
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 250
+
+def test_result_pages_read_slices(tmp_path, monkeypatch):
+    import pandas as pd
+    monkeypatch.setenv('AGENT_OUTPUT_DIR', str(tmp_path / 'shared'))
+    result_id = results.save_table(pd.DataFrame({'n': range(1000)}))
+    assert os.path.isdir(tmp_path / 'shared' / 'results' / result_id)
+    assert results.table_rows(result_id) == 1000
+    page = results.load_table(result_id, offset=995, limit=10)
+    assert page['n'].tolist() == [995, 996, 997, 998, 999]
+    assert results.summarize(result_id)['rows'] == 1000
+
+def test_results_and_spools_expire(tmp_path, monkeypatch):
+    import time
+    import pandas as pd
+    monkeypatch.setenv('AGENT_OUTPUT_DIR', str(tmp_path))
+    monkeypatch.setattr(results, 'RETENTION', 60)
+    old, fresh = results.save_table(pd.DataFrame({'n': [1]})), results.save_table(pd.DataFrame({'n': [2]}))
+    spool = tmp_path / ('0' * 32 + '_stdout.txt')
+    spool.write_text('x')
+    past = time.time() - 120
+    for path in (tmp_path / 'results' / old, spool):
+        os.utime(path, (past, past))
+    assert client.get(f"/results/{old}").status_code == 404
+    assert client.get(f"/results/{fresh}").status_code == 200
+    assert results.cleanup() == 1
+    assert not spool.exists()
+    assert results.table_rows(fresh) == 1
+
+def test_result_stream_rejects_bad_chunk_size(tmp_path, monkeypatch):
+    import pandas as pd
+    monkeypatch.setenv('AGENT_OUTPUT_DIR', str(tmp_path))
+    result_id = results.save_table(pd.DataFrame({'n': range(5)}))
+    assert client.get(f"/results/{result_id}/stream", params={"chunk_size": -1}).status_code == 400
+    assert client.get(f"/results/{result_id}/stream", params={"chunk_size": 0}).status_code == 400
+
+def test_result_unknown_id():
+    assert client.get("/results/../../etc").status_code == 404
+    assert client.get("/results/" + "0" * 32).status_code == 404
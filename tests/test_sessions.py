@@ -0,0 +1,129 @@
+"""Tests for stateful per-dataset execution sessions."""
+import sys, os, shutil
+
+# Ensure app package importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from app import results, sessions
+from app.tools import run_python
+
+PD = "import pandas as pd\n"
+EXAMPLES = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'examples'))
+
+@pytest.fixture
+def csv_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dest = tmp_path / 'complex.csv'
+    shutil.copy(os.path.join(EXAMPLES, 'complex.csv'), dest)
+    yield str(dest)
+    sessions.close_all()
+
+def test_session_reused_and_df_read_only(csv_file):
+    g = {'csv_path': csv_file}
+    first = run_python(PD + "df['num1'] = 0\nprint(df['num1'].sum())", globals_dict=g)
+    assert first['exit_code'] == 0, first['stderr']
+    assert first['stdout'].strip() == '0'
+    session = sessions.get_session(csv_file)
+    second = run_python(PD + "print(df['num1'].sum())", globals_dict=g)
+    assert second['stdout'].strip() == '55.0'
+    # Same kernel process served both snippets
+    assert sessions.get_session(csv_file) is session
+    assert session.alive()
+
+def test_session_errors_and_side_channel(csv_file):
+    g = {'csv_path': csv_file}
+    result = run_python("import pandas as pd\nprint(1 / 0)", globals_dict=g)
+    assert result['exit_code'] == 1
+    assert 'ZeroDivisionError' in result['stderr']
+    assert 'kernel.py' not in result['stderr']
+    result = run_python(PD + "emit_result(df.groupby('cat1')['num1'].sum())", globals_dict=g)
+    assert result['exit_code'] == 0
+    assert result['result_id'] and results.table_rows(result['result_id']) > 0
+    assert result['files'] == []
+
+def test_module_state_not_shared(csv_file):
+    g = {'csv_path': csv_file}
+    result = run_python(PD + "pd.Series.sum = lambda self, *a, **k: -1\nprint(df['num1'].sum())", globals_dict=g)
+    assert result['stdout'].strip() == '-1'
+    result = run_python(PD + "print(df['num1'].sum())", globals_dict=g)
+    assert result['stdout'].strip() == '55.0'
+
+def test_code_without_pandas_not_run_in_session(csv_file, monkeypatch):
+    import subprocess
+    calls = []
+    def fake_run(cmd, **kwargs):
+        calls.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0)
+    monkeypatch.setattr('app.tools.subprocess.run', fake_run)
+    run_python("print(len(df))", globals_dict={'csv_path': csv_file})
+    assert calls[-1][:2] == ['docker', 'run']
+    assert not sessions._sessions
+
+def test_standalone_script_gets_df(csv_file, monkeypatch):
+    monkeypatch.setattr('app.tools.SESSIONS_ENABLED', False)
+    result = run_python(PD + "print(len(df))", globals_dict={'csv_path': csv_file})
+    assert result['stdout'].strip() == '10'
+    assert not sessions._sessions
+
+def test_session_timeout_keeps_kernel(csv_file):
+    g = {'csv_path': csv_file}
+    session = sessions.get_session(csv_file)
+    result = run_python(PD + "while len(df): pass", globals_dict=g, timeout=1)
+    assert result['timeout'] is True
+    assert result['exit_code'] is None
+    # Only the snippet was killed
+    assert session.alive()
+    result = run_python(PD + "print(len(df))", globals_dict=g)
+    assert result['stdout'].strip() == '10'
+    assert sessions.get_session(csv_file) is session
+
+def test_snippets_run_concurrently(csv_file):
+    import threading
+    g = {'csv_path': csv_file}
+    sessions.get_session(csv_file)
+    out = {}
+    def slow():
+        out['slow'] = run_python(PD + "while len(df): pass", globals_dict=g, timeout=3)
+    t = threading.Thread(target=slow)
+    t.start()
+    fast = run_python(PD + "print(len(df))", globals_dict=g, timeout=2)
+    t.join()
+    assert fast['stdout'].strip() == '10'
+    assert out['slow']['timeout'] is True
+
+def test_unreadable_csv_returns_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bad = tmp_path / 'latin1.csv'
+    bad.write_bytes('name,city\nJos\xe9,M\xe1laga\n'.encode('latin-1'))
+    try:
+        g = {'csv_path': str(bad)}
+        result = run_python(PD + "print(df.shape)", globals_dict=g)
+        assert result['exit_code'] == 1
+        assert 'could not be preloaded' in result['stderr']
+        result = run_python(PD + "print(len(pd.read_csv(csv_path, encoding='latin-1')))", globals_dict=g)
+        assert result['stdout'].strip() == '1'
+    finally:
+        sessions.close_all()
+
+def test_changed_file_gets_new_session(csv_file):
+    old = sessions.get_session(csv_file)
+    with open(csv_file) as f:
+        lines = f.readlines()
+    with open(csv_file, 'w') as f:
+        f.writelines(lines[:4])
+    result = run_python(PD + "print(len(df))", globals_dict={'csv_path': csv_file})
+    assert result['stdout'].strip() == '3'
+    assert sessions.get_session(csv_file) is not old
+
+def test_eviction_and_idle_timeout(csv_file, tmp_path, monkeypatch):
+    other = tmp_path / 'iris.csv'
+    shutil.copy(os.path.join(EXAMPLES, 'iris.csv'), other)
+    monkeypatch.setattr(sessions, 'MAX_SESSIONS', 1)
+    first = sessions.get_session(csv_file)
+    sessions.get_session(str(other))
+    assert not first.alive()
+    assert len(sessions._sessions) == 1
+    monkeypatch.setattr(sessions, 'IDLE_TIMEOUT', 0)
+    sessions._reap_idle()
+    assert len(sessions._sessions) == 0